@@ -0,0 +1,128 @@
+import numpy as np
+
+from analyzer.pipeline import analyze_array
+from utils import tracing
+from utils.ingest import iter_frames
+
+# 与上一次分析的帧相比，缩略图的平均绝对差（0-255）低于此值视为画面没有变化
+FRAME_DIFF_THRESHOLD = 4.0
+
+
+def frame_thumbnail(frame, size=32):
+    """跳帧判断用的缩略采样（约size×size，int16便于相减）"""
+    height, width = frame.shape[:2]
+    return frame[::max(1, height // size), ::max(1, width // size), :3].astype(np.int16)
+
+
+def frame_difference(a, b):
+    """两帧缩略图的平均绝对差，尺寸不同时视为完全不同"""
+    if a.shape != b.shape:
+        return float('inf')
+    return float(np.abs(a - b).mean())
+
+
+class AnimationSummary:
+    """
+    逐帧累计全图五行与九宫五行，只保存计数与求和，内存占用与帧数无关
+    每个采样帧权重相同，跳过的帧按沿用的结果计数
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.frames = 0
+        self.analyzed = 0
+        self.overlay = None
+        # 五行 -> [帧数, 能量值之和, 最高能量值, 最高能量值那一帧的判定依据]
+        self.core = {}
+        # 每宫：五行 -> [帧数, 占比之和, 平均色之和]
+        self.palaces = [{} for _ in registry.luoshu.config["grids"]]
+
+    def add(self, result):
+        self.frames += 1
+        wuxing = result["wuxing"]
+        core = self.core.setdefault(wuxing["name"], [0, 0.0, -1.0, ""])
+        core[0] += 1
+        core[1] += wuxing["score"]
+        if wuxing["score"] > core[2]:
+            core[2], core[3] = wuxing["score"], wuxing["reason"]
+
+        for tally, grid in zip(self.palaces, result["grids"]):
+            entry = tally.setdefault(grid["detected_element"], [0, 0.0, np.zeros(3)])
+            entry[0] += 1
+            entry[1] += grid["element_percent"]
+            entry[2] += grid["dominant_color"]
+
+    def result(self):
+        """
+        合并为单张图片的结果格式：各宫取出现帧数最多的五行（并列时取先出现的），
+        占比与平均色取这些帧的均值，再重新计算生克评分与建议
+        """
+        if not self.frames:
+            raise ValueError("没有可分析的帧")
+
+        name, (count, score_sum, _, reason) = max(self.core.items(), key=lambda item: item[1][0])
+        wuxing = {
+            "name": name,
+            "reason": f"共采样{self.frames}帧，其中{count}帧判定为{name}\n{reason}",
+            "score": score_sum / count,
+        }
+
+        luoshu = self.registry.luoshu
+        grids = []
+        for grid_index, tally in enumerate(self.palaces):
+            element, (count, percent_sum, color_sum) = max(tally.items(), key=lambda item: item[1][0])
+            color = tuple(int(c) for c in color_sum / count)
+            grid = luoshu.grid_result(grid_index, color, element, percent_sum / count)
+            grid["frame_ratio"] = round(count / self.frames, 3)  # 该五行出现的帧比例
+            grids.append(grid)
+
+        return {
+            "wuxing": wuxing,
+            "grids": grids,
+            "report": self.registry.formatter.generate(wuxing, grids),
+            "overlay": self.overlay,
+            "frames": {"sampled": self.frames, "analyzed": self.analyzed,
+                       "skipped": self.frames - self.analyzed},
+        }
+
+
+def iter_animation(frames, registry, diff_threshold=FRAME_DIFF_THRESHOLD, overlay=True):
+    """
+    逐帧分析动图/短视频
+    与上一次分析的帧几乎相同的帧不再分析，直接沿用上一次的结果
+    :param frames: (时间秒, RGB数组) 的可迭代对象（见utils.ingest.iter_frames）
+    :param overlay: 是否为第一帧绘制九宫格叠加图
+    :return: 每帧产出 ("frame", {"time", "skipped", "element", "overlay"})，最后产出 ("result", 合并结果)
+    """
+    summary = AnimationSummary(registry)
+    last_thumbnail = last_result = None
+    for timestamp, frame in frames:
+        thumbnail = frame_thumbnail(frame)
+        skipped = (last_result is not None
+                   and frame_difference(thumbnail, last_thumbnail) < diff_threshold)
+        if skipped:
+            tracing.count("frame_skip")
+        else:
+            last_result = analyze_array(frame, registry, overlay=overlay and summary.overlay is None)
+            last_thumbnail = thumbnail
+            summary.analyzed += 1
+            if summary.overlay is None:
+                summary.overlay = last_result["overlay"]
+        summary.add(last_result)
+        yield "frame", {"time": round(timestamp, 3), "skipped": skipped,
+                        "element": last_result["wuxing"]["name"], "overlay": summary.overlay}
+
+    yield "result", summary.result()
+
+
+def analyze_animation(source, registry, sample_fps=2.0, max_frames=60,
+                      diff_threshold=FRAME_DIFF_THRESHOLD, overlay=True):
+    """
+    动图/短视频完整分析流程
+    :param source: 文件路径或PIL动图
+    :return: 同analyze_array，另有 "frames": {"sampled", "analyzed", "skipped"}
+    """
+    frames = iter_frames(source, sample_fps, max_frames)
+    for key, value in iter_animation(frames, registry, diff_threshold, overlay):
+        if key == "result":
+            return value
@@ -0,0 +1,136 @@
+import logging
+import os
+import shutil
+
+from utils.config import resolve_path
+
+logger = logging.getLogger(__name__)
+
+# 支持的推理后端：PyTorch原生，或一次性导出的ONNX Runtime / OpenVINO模型
+BACKENDS = ("torch", "onnx", "openvino")
+
+# ONNX INT8静态量化的校准图片：项目测试图片加上ultralytics自带的示例图片
+CALIBRATION_DIR = "testdatas"
+CALIBRATION_SIZE = 640
+
+
+def exported_path(yolo_path, backend, int8=False, export_dir="models"):
+    """导出产物在缓存目录中的路径（相对目录按项目根目录解析）"""
+    export_dir = resolve_path(export_dir)
+    stem = os.path.splitext(os.path.basename(yolo_path))[0]
+    suffix = "_int8" if int8 else ""
+    if backend == "onnx":
+        return os.path.join(export_dir, f"{stem}{suffix}.onnx")
+    return os.path.join(export_dir, f"{stem}{suffix}_openvino_model")
+
+
+def export_model(yolo_path, backend, int8=False, export_dir="models"):
+    """
+    把.pt模型导出为指定后端格式并缓存，已导出过则直接复用
+    :param yolo_path: PyTorch权重路径
+    :param backend: onnx / openvino
+    :param int8: 是否做INT8量化（ONNX为QDQ静态量化，OpenVINO为NNCF训练后量化）
+    :param export_dir: 导出产物缓存目录
+    :return: 导出产物路径
+    """
+    if backend not in BACKENDS[1:]:
+        raise ValueError(f"不支持的推理后端：{backend}，可选：{', '.join(BACKENDS)}")
+
+    target = exported_path(yolo_path, backend, int8, export_dir)
+    if os.path.exists(target):
+        return target
+
+    from ultralytics import YOLO
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    logger.info("首次使用%s后端，正在导出%s", backend, yolo_path)
+    # dynamic=True 允许批处理调度器一次送入多张图
+    if backend == "onnx":
+        exported = YOLO(yolo_path).export(format="onnx", dynamic=True)
+        if int8:
+            quantize_onnx(exported, target)
+            os.remove(exported)
+        else:
+            shutil.move(exported, target)
+    else:
+        exported = YOLO(yolo_path).export(format="openvino", dynamic=True, int8=int8)
+        shutil.move(exported, target)
+
+    logger.info("导出完成：%s", target)
+    return target
+
+
+def calibration_images(calibration_dir=CALIBRATION_DIR):
+    """静态量化的校准图片路径"""
+    from ultralytics.utils import ASSETS
+
+    paths = []
+    for folder in (resolve_path(calibration_dir), ASSETS):
+        if os.path.isdir(folder):
+            paths += [os.path.join(folder, name) for name in sorted(os.listdir(folder))
+                      if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp'))]
+    return paths
+
+
+def _letterbox(path, size=CALIBRATION_SIZE):
+    """按ultralytics推理时的方式预处理：等比缩放、灰边(114)填充成正方形，返回 (1,3,size,size) float32"""
+    import numpy as np
+    from PIL import Image
+
+    image = Image.open(path).convert("RGB")
+    scale = size / max(image.size)
+    resized = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                           Image.BILINEAR)
+    canvas = Image.new("RGB", (size, size), (114, 114, 114))
+    canvas.paste(resized, ((size - resized.width) // 2, (size - resized.height) // 2))
+    return (np.asarray(canvas, dtype=np.float32) / 255).transpose(2, 0, 1)[None]
+
+
+def quantize_onnx(source, target, calibration_dir=CALIBRATION_DIR):
+    """
+    ONNX模型INT8静态量化（QDQ格式）
+    动态量化会把卷积变成ConvInteger，CPU上比FP32还慢数倍，卷积网络要用校准图片确定激活范围的静态量化；
+    只量化卷积（权重逐通道int8、激活uint8），DFL的解码卷积与后处理保持FP32，框的位置精度不受影响
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    paths = calibration_images(calibration_dir)
+    if not paths:
+        raise FileNotFoundError(f"INT8量化需要校准图片，{calibration_dir}中没有图片")
+
+    # 动态输入尺寸下符号形状推断无法完成，只做常量折叠等图优化
+    prepared = f"{source}.prep.onnx"
+    quant_pre_process(source, prepared, skip_symbolic_shape=True)
+    try:
+        model = onnx.load(prepared)
+        input_name = model.graph.input[0].name
+        excluded = [node.name for node in model.graph.node if node.op_type == "Conv" and "dfl" in node.name.lower()]
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self._paths = iter(paths)
+
+            def get_next(self):
+                path = next(self._paths, None)
+                return None if path is None else {input_name: _letterbox(path)}
+
+        logger.info("INT8静态量化：%d张校准图片", len(paths))
+        quantize_static(prepared, target, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        op_types_to_quantize=["Conv"], nodes_to_exclude=excluded)
+    finally:
+        os.remove(prepared)
+    return target
+
+
+def load_yolo(yolo_path, backend="torch", int8=False, export_dir="models"):
+    """按后端加载YOLO模型；导出后的模型内嵌类别名，标签到五行的映射保持不变"""
+    from ultralytics import YOLO
+
+    if backend == "torch":
+        if int8:
+            raise ValueError("INT8量化仅支持onnx/openvino后端")
+        return YOLO(yolo_path)
+    return YOLO(export_model(yolo_path, backend, int8, export_dir), task="detect")
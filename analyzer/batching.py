@@ -0,0 +1,91 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceScheduler:
+    """
+    跨请求动态批处理
+    各请求提交的整图/宫格图片先排队，最多等待max_wait_ms或凑满max_batch_size张，
+    再合并为一次YOLO调用，结果按顺序分发回各自的等待方。
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=5):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+
+        self.batches = 0
+        self.images = 0
+        self.last_batch_size = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+
+        self._thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, img_array):
+        """提交一张图片，返回Future，结果为该图片的YOLO结果对象"""
+        future = Future()
+        self._queue.put((img_array, future, time.perf_counter()))
+        return future
+
+    def __call__(self, img_array):
+        """与model(img)的返回格式一致（单元素列表），可直接替换模型调用"""
+        return [self.submit(img_array).result()]
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "images": self.images,
+                "last_batch_size": self.last_batch_size,
+                "avg_batch_size": round(self.images / self.batches, 2) if self.batches else 0.0,
+                "avg_wait_ms": round(self.total_wait / self.images * 1000, 2) if self.images else 0.0,
+                "max_wait_ms": round(self.max_observed_wait * 1000, 2),
+            }
+
+    def _collect(self):
+        """阻塞等待第一张，然后在截止时间内尽量凑满一批"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            images = [item[0] for item in batch]
+            started = time.perf_counter()
+            try:
+                results = self.model(images, verbose=False)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            waits = [started - submitted for _, _, submitted in batch]
+            with self._stats_lock:
+                self.batches += 1
+                self.images += len(batch)
+                self.last_batch_size = len(batch)
+                self.total_wait += sum(waits)
+                self.max_observed_wait = max(self.max_observed_wait, *waits)
+            logger.debug("批量推理：%d张，排队最长%.1fms", len(batch), max(waits) * 1000)
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -1,29 +1,58 @@
-import json
-from PIL import Image
+import hashlib
+
 import numpy as np
 import colorsys
 
 from utils.utils import (
-    get_dominant_color,
     color_to_wuxing,
 )
+from utils.color_stats import color_stats, grid_color_stats, grid_edges, texture_stats
+from utils.region_index import RegionIndex
+from utils.cache import image_key
+from utils import tracing
+from utils.config import load_json
 
 
 from analyzer.wuxing import check_element_harmony
-from analyzer.wuxing_detector import WuxingDetector
+from analyzer.wuxing_detector import WuxingDetector, box_areas
 
 
 
 class LuoshuAnalyzer:
-    def __init__(self, config_path="data/jiugong.json"):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = json.load(f)
+    def __init__(self, config_path="data/jiugong.json", object_detector=None, config=None,
+                 single_pass=False, min_area_ratio=0.1, color_sample_step=1, palette_size=0,
+                 cascade=False, cascade_max_edge=4.0, cascade_max_std=40.0, palace_cache=None):
+        """
+        :param config_path: 九宫配置文件路径
+        :param object_detector: 共享的WuxingDetector实例（为空时自行创建）
+        :param config: 已解析的九宫配置（为空时从config_path读取）
+        :param single_pass: 整图只检测一次，再按相交面积把检测框分配到九宫（否则每宫单独检测）
+        :param min_area_ratio: 单宫模式下物体占该宫面积的最小比例
+        :param color_sample_step: 颜色统计采样步长（1为逐像素）
+        :param palette_size: 每宫输出的调色板颜色数（0为不输出）
+        :param cascade: 单宫检测模式下先做纹理/颜色均匀度判断，纯色、天空、墙面等宫位跳过YOLO直接按颜色判断
+        :param cascade_max_edge: 灰度平均梯度不超过此值视为无纹理（0-255）
+        :param cascade_max_std: RGB通道标准差不超过此值视为颜色均匀（0-255）
+        :param palace_cache: 单宫结果缓存（如utils.cache.ResultCache），按该宫像素内容复用analyze_grid的结果
+        """
+        if config is None:
+            config = load_json(config_path)
+        self.config = config
         self.grid_positions = [
             "乾位(西北)", "坎位(北)", "坤位(西南)",
             "震位(东)", "兑位(西)", "中宫",
             "巽位(东南)", "艮位(东北)", "离位(南)"
         ]
-        self.object_detector = WuxingDetector()  # 物体检测器实例
+        # 物体检测器实例（优先复用外部传入的，避免重复加载YOLO）
+        self.object_detector = object_detector if object_detector is not None else WuxingDetector()
+        self.single_pass = single_pass
+        self.min_area_ratio = min_area_ratio
+        self.color_sample_step = color_sample_step
+        self.palette_size = palette_size
+        self.cascade = cascade
+        self.cascade_max_edge = cascade_max_edge
+        self.cascade_max_std = cascade_max_std
+        self.palace_cache = palace_cache
 
     def get_objects_element(self, img_array):
         """通过物体检测获取五行元素"""
@@ -49,10 +78,8 @@ class LuoshuAnalyzer:
 
 
     def get_dominant_color(self, img_array):
-        """获取九宫格区域的主色"""
-        pixels = img_array.reshape(-1, 3)
-        unique_colors, counts = np.unique(pixels, axis=0, return_counts=True)
-        return tuple(unique_colors[np.argmax(counts)])
+        """获取九宫格区域的主色（量化直方图众数）"""
+        return color_stats(img_array, sample_step=self.color_sample_step)["mode"]
 
     def rgb_to_element(self, rgb):
         """将RGB颜色转换为五行元素"""
@@ -70,23 +97,70 @@ class LuoshuAnalyzer:
         else:
             return "金"
 
-    def analyze_grid(self, grid_img, grid_index):
-        """分析单个九宫格"""
-        grid_data = self.config["grids"][grid_index]
-        img_array = np.array(grid_img)
-        color = get_dominant_color(img_array)
+    def get_palace_wuxing(self, palace_detections, palace_pixels):
+        """根据落在该宫内的检测框判断五行，没有有效物体时返回None"""
+        return self.object_detector.score_detections(
+            palace_detections["classes"], palace_detections["areas"], palace_detections["conf"],
+            palace_pixels, self.min_area_ratio
+        )
+
+    def needs_detection(self, img_array):
+        """级联判断：该宫纹理或颜色足够复杂，才值得跑一次YOLO"""
+        stats = texture_stats(img_array)
+        return stats["edge"] > self.cascade_max_edge or stats["std"] > self.cascade_max_std
 
-        # 优先使用物体检测判断五行
-        element = self.get_objects_element(img_array)
+    def analyze_grid(self, grid_img, grid_index, palace_detections=None, palace_colors=None):
+        """
+        分析单个九宫格
+        :param palace_detections: 单次检测模式下落在该宫内的检测框（classes/areas/conf），为空时对该宫单独检测
+        :param palace_colors: 整图统一计算好的该宫颜色统计（grid_color_stats的一项），为空时单独计算
+        """
+        img_array = np.asarray(grid_img)  # 切片视图直接使用，PIL图片才会转换
+        if palace_colors is None:
+            palace_colors = color_stats(img_array, top_k=self.palette_size,
+                                        sample_step=self.color_sample_step, with_elements=True)
+        color = palace_colors["mean"]
+
+        # 优先使用物体检测判断五行（级联模式下均匀的宫位不检测，直接走颜色判断）
+        wuxing = None
+        if palace_detections is None:
+            if self.cascade and not self.needs_detection(img_array):
+                tracing.count("cascade_skip")
+            else:
+                detections = self.object_detector.detect(img_array)
+                palace_detections = {
+                    "classes": detections["classes"],
+                    "areas": box_areas(detections["xyxy"]),
+                    "conf": detections["conf"],
+                }
+        if palace_detections is not None:
+            wuxing = self.get_palace_wuxing(palace_detections, img_array.shape[0] * img_array.shape[1])
+
+        if wuxing is not None:
+            # 物体按面积加权的能量值即该五行在宫内的占比
+            element = wuxing["name"]
+            element_percent = min(wuxing["score"], 1) * 100
+        else:
+            # 如果没有检测到物体，则使用颜色判断，占比取逐像素五行直方图
+            element = color_to_wuxing(color)["name"]
+            element_percent = palace_colors["elements"][element] * 100
 
-        # 如果没有检测到物体，则使用颜色判断
-        if element is None:
-            color = get_dominant_color(img_array)
-            element = self.rgb_to_element(color)
+        return self.grid_result(grid_index, color, element, element_percent,
+                                palace_colors["palette"] if self.palette_size else None)
+
+    def grid_result(self, grid_index, color, element, element_percent, palette=None):
+        """
+        由宫位的五行判定结果生成输出（生克评分与建议）
+        :param color: 该宫平均色
+        :param element: 判定的五行
+        :param element_percent: 该五行在宫内的占比（0-100）
+        :param palette: 调色板（None为不输出）
+        """
+        grid_data = self.config["grids"][grid_index]
 
         # 检查是否符合该宫位五行
         # is_harmony = (element == grid_data["element"])
-        harmony = check_element_harmony(element, grid_data["element"])
+        harmony = check_element_harmony(element, grid_data["element"], element_percent)
 
         # 生成建议
         suggestion = ""
@@ -96,37 +170,163 @@ class LuoshuAnalyzer:
         else:
             suggestion = f"元素协调，避免{', '.join(grid_data['avoid'][:2])}"
 
-        return {
+        result = {
             "position": self.grid_positions[grid_index],
             "bagua_name": grid_data["name"],
             "symbol": grid_data["symbol"],
             "dominant_color": color,
             "detected_element": element,
+            "element_percent": round(element_percent, 1),
             "expected_element": grid_data["element"],
             "is_harmony": harmony["is_harmony"],
             "suggestion": suggestion,
             "meaning": grid_data["meaning"]
         }
+        if palette is not None:
+            result["palette"] = palette
+        return result
 
-    def analyze_image(self, image):
-        """分析整张图片"""
-        img = Image.fromarray(image)
-        width, height = img.size
-        grid_size = 3
-        results = []
+    def split_detections(self, detections, width, height, grid_size=3):
+        """
+        把整图检测框按相交面积分配到各宫
+        :param detections: WuxingDetector.detect的返回值
+        :return: 每宫一个{"classes", "areas", "conf"}，areas为检测框裁剪到该宫后的面积
+        """
+        # 检测结果来自其它尺寸的图片时，先把坐标换算到当前尺寸
+        det_h, det_w = detections["shape"]
+        xyxy = detections["xyxy"] * np.array([width / det_w, height / det_h] * 2)
+        edges_x = np.array([width * j // grid_size for j in range(grid_size + 1)])
+        edges_y = np.array([height * i // grid_size for i in range(grid_size + 1)])
 
+        # (格子数, 检测框数) 的相交宽高
+        overlap_w = np.clip(np.minimum(xyxy[None, :, 2], edges_x[1:, None])
+                            - np.maximum(xyxy[None, :, 0], edges_x[:-1, None]), 0, None)
+        overlap_h = np.clip(np.minimum(xyxy[None, :, 3], edges_y[1:, None])
+                            - np.maximum(xyxy[None, :, 1], edges_y[:-1, None]), 0, None)
+
+        palaces = []
+        for i in range(grid_size):
+            for j in range(grid_size):
+                areas = overlap_h[i] * overlap_w[j]
+                keep = np.flatnonzero(areas > 0)
+                palaces.append({
+                    "classes": detections["classes"][keep],
+                    "areas": areas[keep],
+                    "conf": detections["conf"][keep],
+                })
+        return palaces
+
+    def palace_views(self, image, grid_size=3):
+        """
+        按九宫切分整图，产出 (格子索引, 该宫的切片视图)
+        切片与原图共用内存，不复制像素
+        """
+        height, width = image.shape[:2]
         for i in range(grid_size):
             for j in range(grid_size):
-                # 切割九宫格
                 left = width * j // grid_size
                 upper = height * i // grid_size
                 right = width * (j + 1) // grid_size
                 lower = height * (i + 1) // grid_size
-                grid_img = img.crop((left, upper, right, lower))
+                yield i * grid_size + j, image[upper:lower, left:right]
+
+    def palace_key(self, grid_view, grid_index, image_shape, palace_detections=None):
+        """
+        单宫结果的缓存键：该宫像素、所在位置与整图尺寸（决定采样对齐）、分析参数，
+        以及整图检测模式下分配到该宫的检测框
+        """
+        h = hashlib.sha256(f"{grid_index}|{image_shape[:2]}|{self.min_area_ratio}|{self.color_sample_step}|"
+                           f"{self.palette_size}|{self.cascade}|{self.cascade_max_edge}|"
+                           f"{self.cascade_max_std}".encode())
+        if palace_detections is None:
+            h.update(b"|detect")  # 该宫单独检测，结果只取决于像素
+        else:
+            for name in ("classes", "areas", "conf"):
+                h.update(np.ascontiguousarray(palace_detections[name]))
+        return image_key(grid_view, h.hexdigest())
+
+    def analyze_image(self, image, detections=None, index=None):
+        """
+        分析整张图片
+        :param detections: 整图检测结果（WuxingDetector.detect的返回值）。
+                           传入或开启single_pass时只检测一次，否则每宫单独检测
+        :param index: 该图片的RegionIndex（调用方还要做子宫格/热点查询时传入以共用），为空时内部构建
+        """
+        return [result for _, result in self.iter_image(image, detections, index)]
+
+    def palace_colors(self, image, grid_index, grid_size=3):
+        """
+        单独统计一宫的平均色、五行占比（与调色板），结果与整图统计中该宫的一项相同
+        采样点与整图的采样网格对齐：从不小于宫格边界的第一个采样步长倍数开始
+        """
+        i, j = divmod(grid_index, grid_size)
+        top, bottom = grid_edges(image.shape[0], grid_size)[i:i + 2]
+        left, right = grid_edges(image.shape[1], grid_size)[j:j + 2]
+        step = self.color_sample_step
+        view = image[-(-top // step) * step:bottom, -(-left // step) * step:right]
+        return color_stats(view, top_k=self.palette_size, sample_step=step, with_elements=True)
+
+    def region_index(self, image):
+        """按本分析器的采样步长为整张图片构建积分图索引"""
+        return RegionIndex(np.asarray(image), self.color_sample_step)
+
+    def iter_image(self, image, detections=None, index=None):
+        """
+        逐宫分析整张图片，每算完一宫就产出 (格子索引, analyze_grid结果)，供界面流式展示
+        参数同analyze_image
+        设置了palace_cache时，像素未变的宫位直接复用缓存结果（局部修改后重新上传只重算改动的宫位），
+        部分命中时颜色统计也只对未命中的宫位单独计算
+        """
+        image = np.asarray(image)
+        height, width = image.shape[:2]
+        grid_size = 3
+
+        palaces = None
+        if detections is None and self.single_pass:
+            detections = self.object_detector.detect(image)
+        if detections is not None:
+            palaces = self.split_detections(detections, width, height, grid_size)
 
-                # 计算当前格子索引（0-8）
-                grid_index = i * grid_size + j
-                results.append(self.analyze_grid(grid_img, grid_index))
+        views = list(self.palace_views(image, grid_size))
+        keys = cached = None
+        if self.palace_cache is not None:
+            with tracing.stage("palace_cache"):
+                keys = [self.palace_key(view, grid_index, image.shape,
+                                        palaces[grid_index] if palaces is not None else None)
+                        for grid_index, view in views]
+                cached = [self.palace_cache.get(key) for key in keys]
+            reused = sum(result is not None for result in cached)
+            tracing.count("palace_reuse", reused)
+            tracing.count("palace_recompute", len(views) - reused)
+            if reused == len(views):
+                for grid_index, _ in views:
+                    yield grid_index, dict(cached[grid_index])
+                return
 
-        return results
+        with tracing.stage("color_stats"):
+            if index is None and cached is not None and reused:
+                # 只统计需要重算的宫位，不为整图建积分图
+                colors = [None if result is not None else self.palace_colors(image, grid_index, grid_size)
+                          for grid_index, result in enumerate(cached)]
+            else:
+                # 九宫平均色与五行占比都从整图的积分图查表得到
+                if index is None:
+                    index = self.region_index(image)
+                colors = index.grid_stats(grid_size)
+                if self.palette_size:
+                    # 调色板需要颜色直方图，只在要求输出时才统计
+                    palettes = grid_color_stats(image, grid_size, top_k=self.palette_size,
+                                                sample_step=self.color_sample_step)
+                    for color, palette in zip(colors, palettes):
+                        color["palette"] = palette["palette"]
 
+        for grid_index, grid_view in views:
+            if cached is not None and cached[grid_index] is not None:
+                yield grid_index, dict(cached[grid_index])  # 副本，调用方修改不影响缓存
+                continue
+            palace_detections = palaces[grid_index] if palaces is not None else None
+            with tracing.stage("palaces"):
+                result = self.analyze_grid(grid_view, grid_index, palace_detections, colors[grid_index])
+            if keys is not None:
+                self.palace_cache.put(keys[grid_index], dict(result))
+            yield grid_index, result
@@ -0,0 +1,70 @@
+from PIL import Image
+
+from utils.ingest import COLOR_MAX_SIDE, DETECT_MAX_SIDE, downscale
+from utils.overlay import draw_ninehalls
+from utils import tracing
+
+
+def analyze_array(image, registry, overlay=True):
+    """
+    头像分析完整流程（不含缓存），网页端与批处理共用
+    :param image: 图片array（RGB，展示分辨率，见utils.ingest.load_image）
+    :param registry: ModelRegistry实例
+    :param overlay: 是否绘制九宫格叠加图
+    :return: {"wuxing": 全图五行, "grids": 九宫分析结果, "report": 报告文本, "overlay": 叠加图或None}
+    """
+    result = {"wuxing": None, "grids": [], "report": None, "overlay": None}
+    for key, value in iter_analysis(image, registry, overlay):
+        if key == "grid":
+            result["grids"].append(value)
+        else:
+            result[key] = value
+    return result
+
+
+def iter_analysis(image, registry, overlay=True):
+    """
+    流式版analyze_array：每完成一步就产出 (键, 值)，依次为
+    ("overlay", 叠加图或None) → ("wuxing", 全图五行) → 9次("grid", 单宫结果) → ("report", 报告文本)
+    叠加图不需要推理，全图五行在一次YOLO之后即可给出，九宫与报告随后逐步产出
+    """
+    luoshu_analyzer = registry.luoshu
+    wuxing_analyzer = registry.detector
+
+    ''' 1. 九宫格切割'''
+
+    # fromarray已复制出独立的图片，直接在上面绘制
+    with tracing.stage("overlay"):
+        grid_img = draw_ninehalls(Image.fromarray(image), copy=False) if overlay else None
+    yield "overlay", grid_img
+
+    ''' 2. 五行属性分析 '''
+    # 检测与颜色统计各用缩小后的副本，分辨率不超过各自所需
+    detect_array = downscale(image, DETECT_MAX_SIDE)
+    color_array = downscale(image, COLOR_MAX_SIDE)
+    # 整图只跑一次YOLO，结果同时用于全图五行和九宫分析
+    detections = wuxing_analyzer.detect(detect_array)
+    with tracing.stage("analyze_wuxing"):
+        wuxing = wuxing_analyzer.analyze_wuxing(detect_array, detections=detections)
+    yield "wuxing", wuxing
+
+    ''' 3. 方位吉凶分析'''
+    # 检测框坐标会按尺寸比例换算到color_array上
+    results = []
+    for _, grid_result in tracing.iterate("luoshu", luoshu_analyzer.iter_image(color_array, detections)):
+        results.append(grid_result)
+        yield "grid", grid_result
+
+    ''' 4. 生成报告 '''
+
+    # 格式化，不组织语言版
+    formatter = registry.formatter
+    with tracing.stage("report"):
+        report = formatter.generate(wuxing, results)
+
+    # 组织语言版
+    # generator = ReportGenerator()
+    # report = generator.generate_report()
+    # print(generator.generate_report())
+
+    yield "report", report
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from analyzer.luoshu import LuoshuAnalyzer
+from analyzer.wuxing import WUXING_CONFIG, get_rules
+from analyzer.wuxing_detector import WuxingDetector
+from utils.config import load_json, resolve_path
+from utils.report_format import ReportFormatter
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss_mb():
+    """当前进程常驻内存（MB），平台不支持时返回None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    # 非Linux平台退化为峰值内存
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表
+    YOLO模型、五行映射表、九宫配置和报告模板每个进程只加载一次，
+    WuxingDetector与LuoshuAnalyzer共用同一个检测器实例。
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, yolo_path='yolo11n.pt',
+                 mapping_path='data/wuxing_mapping.json',
+                 jiugong_path='data/jiugong.json',
+                 backend='torch', int8=False):
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        self.fingerprint = _fingerprint(f"{backend}|{int8}", yolo_path, mapping_path, jiugong_path,
+                                        WUXING_CONFIG, 'data/result_template.txt')
+
+        self.detector = WuxingDetector(config_path=mapping_path, yolo_path=yolo_path,
+                                       backend=backend, int8=int8)
+        self.jiugong = load_json(jiugong_path)
+        self.luoshu = LuoshuAnalyzer(config=self.jiugong, object_detector=self.detector)
+        self.formatter = ReportFormatter()
+        # 五行矩阵本身按需加载，这里提前编译一次，配置有误时启动即报错而不是等到第一个请求
+        self.rules = get_rules()
+
+        self.load_time = time.perf_counter() - start
+        rss_after = current_rss_mb()
+        self.memory_mb = rss_after - rss_before if rss_before is not None else None
+        self.warmup_time = None
+
+        logger.info("模型加载完成（%s%s）：耗时%.2fs，内存占用%s", backend, "+INT8" if int8 else "",
+                    self.load_time, _format_mb(self.memory_mb))
+
+    @classmethod
+    def get(cls, **kwargs):
+        """获取进程内唯一的注册表实例（首次调用时加载）"""
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = cls(**kwargs)
+        return cls._instance
+
+    def warmup(self, size=640):
+        """用空白图跑一次推理，提前完成模型的延迟初始化"""
+        start = time.perf_counter()
+        self.detector.model(np.zeros((size, size, 3), dtype=np.uint8), verbose=False)
+        self.warmup_time = time.perf_counter() - start
+        logger.info("模型预热完成：耗时%.2fs", self.warmup_time)
+        return self
+
+    def enable_batching(self, max_batch_size=8, max_wait_ms=5):
+        """
+        检测器改走跨请求批处理调度器（网页端并发场景）
+        max_batch_size=1时不合批，只让所有推理在调度线程中逐张执行，多个请求线程不会同时调用模型
+        """
+        from analyzer.batching import InferenceScheduler
+        if self.detector.scheduler is None:
+            self.detector.scheduler = InferenceScheduler(self.detector.model, max_batch_size, max_wait_ms)
+        return self
+
+    def enable_palace_cache(self, max_items=256):
+        """九宫分析按宫位像素缓存结果，局部修改后重新上传的头像只重算改动的宫位"""
+        from utils.cache import ResultCache
+        if self.luoshu.palace_cache is None:
+            self.luoshu.palace_cache = ResultCache(max_items=max_items)
+        return self
+
+    def stats(self):
+        """加载耗时与内存占用"""
+        return {
+            "load_time": round(self.load_time, 3),
+            "warmup_time": round(self.warmup_time, 3) if self.warmup_time is not None else None,
+            "memory_mb": _round(self.memory_mb),
+            "rss_mb": _round(current_rss_mb()),
+            "scheduler": self.detector.scheduler.stats() if self.detector.scheduler else None,
+            "palace_cache": self.luoshu.palace_cache.stats() if self.luoshu.palace_cache else None,
+        }
+
+
+def _fingerprint(backend, yolo_path, *config_paths):
+    """模型版本、推理后端与配置内容的指纹，用作结果缓存键的一部分"""
+    h = hashlib.sha256(backend.encode())
+    try:
+        stat = os.stat(yolo_path)
+        h.update(f"{yolo_path}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+    except OSError:  # 模型尚未下载，由ultralytics按名称获取
+        h.update(yolo_path.encode())
+    for path in config_paths:
+        with open(resolve_path(path), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+def _format_mb(value):
+    return f"{value:.1f}MB" if value is not None else "未知"
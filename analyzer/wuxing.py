@@ -1,32 +1,143 @@
-import json
+import re
+from functools import lru_cache
 
-# 加载矩阵
-with open('data/wuxing.json', 'r', encoding='utf-8') as f:
-    wuxing_data = json.load(f)
+import numpy as np
 
+from utils.config import load_json
 
-def get_element_interaction(ideal, actual, percent):
-    """ 获取五行相互作用详情 """
-    rule = wuxing_data['matrix'][ideal][actual]
+WUXING_CONFIG = 'data/wuxing.json'
 
-    # 动态计算修正值（安全执行公式）
-    try:
-        dynamic = eval(rule['formula'], {'x': percent / 100})
-    except:
-        dynamic = 1.0
 
-    # 反克规则检查
-    if percent > wuxing_data['special_rules']['反克阈值'] and rule.get('warning'):
-        dynamic *= 1.3  # 反克补偿
+# 支持的公式形式：a*x、x*a、x，可再加减常数项（如 "x*1.2+0.1"）
+_NUMBER = r'\d+(?:\.\d+)?'
+_FORMULA_PATTERN = re.compile(
+    rf'^(?:(?P<pre>{_NUMBER})\*)?x(?:\*(?P<post>{_NUMBER}))?(?:(?P<sign>[+-])(?P<const>{_NUMBER}))?$'
+)
+
+# 建议分级：评分落在 (下界, 上界] 内取对应建议，从低到高排列
+_ADVICE_EDGES = np.array([0, 0.5, 0.75, 0.9, 1.0, 1.5])
+_ADVICE_TEXTS = [
+    "严重冲突，需重新设计",
+    None,  # 建议调整：取规则自带的suggestion
+    "基本和谐，细节可提升",
+    "轻微调整即可优化",
+    "完美契合，保持当前元素",
+]
+
+
+def parse_formula(formula):
+    """
+    把线性公式解析为 (斜率, 截距)
+    :raises ValueError: 公式不是支持的线性形式
+    """
+    match = _FORMULA_PATTERN.match(formula.replace(' ', ''))
+    if match is None:
+        raise ValueError(f"不支持的公式：{formula!r}（仅支持 a*x+b 形式）")
+    slope = float(match['pre'] or 1.0) * float(match['post'] or 1.0)
+    intercept = float(match['const'] or 0.0)
+    if match['sign'] == '-':
+        intercept = -intercept
+    return slope, intercept
+
+
+class RuleMatrix:
+    """
+    编译后的五行生克矩阵
+    按 [理想五行, 实际五行] 存放基础系数、公式斜率/截距和反克/致命标记，
+    评分全部由数组查表完成。
+    """
+
+    def __init__(self, data):
+        self.elements = data['elements']
+        self.index = {e: i for i, e in enumerate(self.elements)}
+        n = len(self.elements)
+
+        self.base = np.ones((n, n))
+        self.slope = np.ones((n, n))
+        self.intercept = np.zeros((n, n))
+        self.warning = np.zeros((n, n), dtype=bool)
+        self.critical = np.zeros((n, n), dtype=bool)
+        self.desc = [[''] * n for _ in range(n)]
+        self.suggestion = [[''] * n for _ in range(n)]
+
+        for ideal, row in data['matrix'].items():
+            for actual, rule in row.items():
+                i, a = self.index[ideal], self.index[actual]
+                try:
+                    self.slope[i, a], self.intercept[i, a] = parse_formula(rule['formula'])
+                except ValueError as e:
+                    raise ValueError(f"五行矩阵[{ideal}][{actual}]：{e}") from None
+                self.base[i, a] = rule['base']
+                self.warning[i, a] = bool(rule.get('warning'))
+                self.critical[i, a] = rule.get('critical', False)
+                self.desc[i][a] = rule['desc']
+                self.suggestion[i][a] = rule.get('suggestion', '')
+
+        special = data['special_rules']
+        self.counter_threshold = special['反克阈值']
+        self.score_min = special['能量修正范围']['min']
+        self.score_max = special['能量修正范围']['max']
+
+    def to_index(self, elements):
+        """五行名称（或名称数组）转下标，已是下标时原样返回"""
+        elements = np.asarray(elements)
+        if elements.dtype.kind in 'iu':
+            return elements
+        lookup = np.vectorize(self.index.__getitem__, otypes=[np.intp])
+        return lookup(elements)
+
+    def scores(self, ideal, actual, percent, counter_compensation=False):
+        """
+        批量计算生克评分，参数可以是任意形状（可广播）的数组
+        :param ideal: 理想五行下标
+        :param actual: 实际五行下标
+        :param percent: 实际五行占比（0-100）
+        :param counter_compensation: 是否对超过反克阈值的warning规则乘1.3
+        """
+        percent = np.asarray(percent, dtype=float)
+        dynamic = percent / 100 * self.slope[ideal, actual] + self.intercept[ideal, actual]
+        if counter_compensation:
+            triggered = (percent > self.counter_threshold) & self.warning[ideal, actual]
+            dynamic = np.where(triggered, dynamic * 1.3, dynamic)  # 反克补偿
+        return np.clip(self.base[ideal, actual] * dynamic, self.score_min, self.score_max)
+
+    def advice_level(self, scores):
+        """评分对应的建议分级（_ADVICE_TEXTS的下标）"""
+        return np.searchsorted(_ADVICE_EDGES, scores, side='left') - 1
+
+    def advice(self, level, ideal, actual):
+        text = _ADVICE_TEXTS[level]
+        if text is None:
+            text = f"建议调整：{self.suggestion[ideal][actual] or '参考五行生克'}"
+        return text
+
+
+@lru_cache(maxsize=None)
+def get_rules(config_path=WUXING_CONFIG):
+    """首次使用时加载并编译五行矩阵，之后复用"""
+    return RuleMatrix(load_json(config_path))
+
+
+def __getattr__(name):
+    # 兼容旧的模块级变量：wuxing_data / RULES 改为首次访问时加载
+    if name == 'wuxing_data':
+        return load_json(WUXING_CONFIG)
+    if name == 'RULES':
+        return get_rules()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-    # 最终分数
-    score = min(max(rule['base'] * dynamic, 0.1), 1.5)
+def get_element_interaction(ideal, actual, percent):
+    """ 获取五行相互作用详情 """
+    rules = get_rules()
+    i, a = rules.index[ideal], rules.index[actual]
+    score = float(rules.scores(i, a, percent, counter_compensation=True))
 
     return {
         'score': round(score, 2),
-        'description': rule['desc'],
-        'suggestion': rule.get('suggestion', ''),
-        'is_critical': rule.get('critical', False)
+        'description': rules.desc[i][a],
+        'suggestion': rules.suggestion[i][a],
+        'is_critical': bool(rules.critical[i, a])
     }
 
 
@@ -36,7 +147,7 @@ def check_element_harmony(grid_element, grid_ideal_element, element_percent=95):
     参数：
         grid_element: str - 实际检测到的五行（木/火/土/金/水）
         grid_ideal_element: str - 宫位理论五行
-        element_percent: int - 该元素在宫位的占比（0-100，默认50）
+        element_percent: float - 该元素在宫位的占比（0-100，默认95）
 
     返回：
         {
@@ -47,8 +158,9 @@ def check_element_harmony(grid_element, grid_ideal_element, element_percent=95):
         }
     """
     # 1. 获取生克规则
+    rules = get_rules()
     try:
-        rule = wuxing_data['matrix'][grid_ideal_element][grid_element]
+        i, a = rules.index[grid_ideal_element], rules.index[grid_element]
     except KeyError:
         return {
             "is_harmony": False,
@@ -57,38 +169,44 @@ def check_element_harmony(grid_element, grid_ideal_element, element_percent=95):
             "advice": "请检查元素名称是否符合木/火/土/金/水"
         }
 
-    # 2. 计算动态评分
-    try:
-        dynamic_coeff = eval(rule['formula'], {'x': element_percent / 100})
-    except:
-        dynamic_coeff = 1.0
-
-    score = min(max(rule['base'] * dynamic_coeff, 0.1), 1.5)
-
-    # 反克规则检查
-    if element_percent > wuxing_data['special_rules']['反克阈值'] and rule.get('warning'):
-        dynamic_coeff *= 1.3  # 反克补偿
+    # 2. 计算动态评分（宫位评分不做反克补偿）
+    score = float(rules.scores(i, a, element_percent))
 
     # 3. 生成建议
-    # 修正后的建议分级逻辑
-    advice_map = [
-        (1.0, 1.5, "完美契合，保持当前元素"),
-        (0.9, 1.0, "轻微调整即可优化"),
-        (0.75, 0.9, "基本和谐，细节可提升"),
-        (0.5, 0.75, f"建议调整：{rule.get('suggestion', '参考五行生克')}"),
-        (0.1, 0.5, "严重冲突，需重新设计")
-    ]
-
-    # 按顺序检查区间（从高到低）
-    for min_score, max_score, advice_text in advice_map:
-        if min_score < score <= max_score:  # 注意开闭区间
-            advice = advice_text
-            break
-    else:
-        advice = "能量状态异常"  # 默认值（理论上不会触发）
+    advice = rules.advice(int(rules.advice_level(score)), i, a)
     return {
         "is_harmony": score >= 0.75,
         "score": round(score, 2),
-        "relationship": rule['desc'],
+        "relationship": rules.desc[i][a],
         "advice": advice
     }
+
+
+def check_harmony_batch(grid_elements, grid_ideal_elements, element_percents):
+    """
+    批量版check_element_harmony，一次数组运算完成全部评分
+    可用于一张图的九宫，也可用于成千上万张图（参数形状可广播，如 (图片数, 9)）
+
+    参数：
+        grid_elements: 实际五行（名称或下标数组）
+        grid_ideal_elements: 宫位理论五行（名称或下标数组）
+        element_percents: 各宫实际五行占比（0-100）
+
+    返回：
+        {
+            "is_harmony": bool数组,
+            "score": float数组（保留两位小数）,
+            "critical": bool数组,  # 是否为致命相克
+            "advice_level": int数组  # 0严重冲突 ~ 4完美契合
+        }
+    """
+    rules = get_rules()
+    actual = rules.to_index(grid_elements)
+    ideal = rules.to_index(grid_ideal_elements)
+    scores = rules.scores(ideal, actual, element_percents)
+    return {
+        "is_harmony": scores >= 0.75,
+        "score": np.round(scores, 2),
+        "critical": rules.critical[ideal, actual],
+        "advice_level": rules.advice_level(scores),
+    }
@@ -1,120 +1,164 @@
-import cv2
 import numpy as np
-from ultralytics import YOLO
-import json
 from PIL import Image
 from utils.utils import (
+    ELEMENTS,
     get_dominant_color,
     color_to_wuxing,
 )
+from utils.color_stats import color_stats
+from analyzer.backends import load_yolo
+from utils import tracing
+from utils.config import load_json
+
+
+# 多个五行得分并列时，按 金木水火土 的顺序取第一个
+_TIE_ORDER = np.array([ELEMENTS.index(e) for e in ("金", "木", "水", "火", "土")])
+
+
+def box_areas(xyxy):
+    """(N,4) 检测框坐标 -> (N,) 面积"""
+    return (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+
+
+def compile_mapping(mapping, names):
+    """
+    把五行映射表编译为按YOLO类别id索引的权重矩阵
+    :param mapping: wuxing_mapping.json的内容（类别名 -> {element, name, reason}）
+    :param names: 模型的类别表（id -> 类别名）
+    :return: ((类别数, 5) 权重矩阵，列顺序同ELEMENTS, 每个类别id对应的映射项列表)
+    """
+    n_classes = max(names) + 1 if names else 0
+    weights = np.zeros((n_classes, len(ELEMENTS)))
+    entries = [mapping["default"]] * n_classes
+    for class_id, label in names.items():
+        entry = mapping.get(label, mapping["default"])
+        entries[class_id] = entry
+        for element, weight in entry["element"].items():
+            weights[class_id, ELEMENTS.index(element)] = weight
+    return weights, entries
 
 
 class WuxingDetector:
-    def __init__(self, config_path='data/wuxing_mapping.json', yolo_path='yolo11n.pt'):
+    def __init__(self, config_path='data/wuxing_mapping.json', yolo_path='yolo11n.pt',
+                 backend='torch', int8=False, export_dir='models'):
+        """
+        :param backend: 推理后端 torch / onnx / openvino（非torch时首次使用会导出并缓存到export_dir）
+        :param int8: 是否使用INT8量化模型（仅onnx/openvino）
+        """
         # 初始化YOLO
-        self.model = YOLO(yolo_path)  # 可选：yolov8s/m/l/x
+        self.model = load_yolo(yolo_path, backend, int8, export_dir)  # 可选：yolov8s/m/l/x
+        self.backend = backend
         # 加载五行映射表
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.WUXING_MAPPING = json.load(f)
+        self.WUXING_MAPPING = load_json(config_path)
+        names = self.model.names
+        if isinstance(names, (list, tuple)):
+            names = dict(enumerate(names))
+        self.class_names = names
+        self.class_weights, self.class_entries = compile_mapping(self.WUXING_MAPPING, names)
+        # 跨请求批处理调度器（InferenceScheduler），为空时直接调用模型
+        self.scheduler = None
+
+    def detect(self, image_array):
+        """
+        对整张图跑一次YOLO，返回全部检测框（不做面积/置信度过滤）
+        :param image_array: 图片array
+        :return: {"xyxy": (N,4)坐标, "conf": (N,)置信度, "classes": (N,)类别id,
+                  "labels": 类别名列表, "shape": (h, w)}
+        """
+        return self._detect_array(self._to_array(image_array))
+
+    def _detect_array(self, img_array):
+        infer = self.scheduler if self.scheduler is not None else self.model
+        with tracing.stage("yolo"):
+            results = infer(img_array)  # 关键修改：直接传数组而非路径
+        tracing.count("inference")
+
+        # 整批取回，不再逐个检测框转换
+        boxes = results[0].boxes
+        classes = np.asarray(boxes.cls.cpu().numpy(), dtype=np.intp).reshape(-1)
+        return {
+            "xyxy": np.asarray(boxes.xyxy.cpu().numpy(), dtype=np.float64).reshape(-1, 4),
+            "conf": np.asarray(boxes.conf.cpu().numpy(), dtype=np.float64).reshape(-1),
+            "classes": classes,
+            "labels": [self.class_names[c] for c in classes.tolist()],
+            "shape": img_array.shape[:2],
+        }
+
+    def score_detections(self, classes, areas, confidences, total_pixels, min_area_ratio=0.1):
+        """
+        按面积加权计算五行
+        :param classes: 各检测框的类别id
+        :param areas: 各检测框（或其裁剪部分）的面积
+        :param confidences: 各检测框置信度
+        :param total_pixels: 参照区域的像素总数
+        :param min_area_ratio: 物体最小占比阈值（默认10%）
+        :return: {"name": 主五行, "reason": 判定依据, "score": 能量值}，没有有效物体时返回None
+        """
+        # 提取有效物体（面积>10%，置信度>50%）
+        classes = np.asarray(classes, dtype=np.intp)
+        area_ratios = np.round(np.asarray(areas, dtype=np.float64) / total_pixels, 2)
+        valid = (np.asarray(areas) / total_pixels >= min_area_ratio) & (np.asarray(confidences) > 0.5)
+        if not valid.any():
+            return None
+
+        # 根据物体判断五行：各类别权重按面积加权求和
+        classes = classes[valid]
+        weights = area_ratios[valid] @ self.class_weights[classes]
+        best = _TIE_ORDER[np.argmax(weights[_TIE_ORDER])]
+
+        # 判定依据只对有效物体拼接一次，同类物体只列一行
+        reason = "".join(f"{self.class_entries[c]['name']}: {self.class_entries[c]['reason']}\n"
+                         for c in dict.fromkeys(classes.tolist()))
+        return {
+            "name": ELEMENTS[best],
+            "reason": reason,
+            "score": float(weights[best])
+        }
 
-    def analyze_wuxing(self,image_array):
+    def analyze_wuxing(self, image_array, detections=None):
         """
         分析图像五行属性
         :param image_array: 图片array
-        :param min_area_ratio: 物体最小占比阈值（默认10%）
-        :return: {"wuxing": 五行结果, "method": 检测方式, "details": 详情}
+        :param detections: 已有的整图检测结果（detect的返回值），为空时重新检测
+        :return: {"name": 五行结果, "reason": 判定依据, "score": 能量值}
         """
 
         min_area_ratio = 0.1
 
-        # 读取图像并获取尺寸
-        # 统一转换为RGB numpy数组
-        if isinstance(image_array, Image.Image):
-            img_array = np.array(image_array)
-            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)  # PIL转OpenCV格式
-        elif isinstance(image_array, np.ndarray):
-            img_array = image_array.copy()  # 避免修改原数组
-        else:
-            raise ValueError("Unsupported image type. Expected PIL.Image or numpy array.")
+        img_array = self._to_array(image_array)
+        if detections is None:
+            detections = self._detect_array(img_array)
 
         h, w = img_array.shape[:2]
-        total_pixels = h * w
-        detections = []
-
-        results = self.model(img_array)  # 关键修改：直接传数组而非路径
-
-        # 提取有效物体（面积>10%）
-        for box in results[0].boxes:
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            area = (x2 - x1) * (y2 - y1)
-            if area / total_pixels >= min_area_ratio and box.conf > 0.5:  # 置信度>50%
-                label = self.model.names[int(box.cls)]
-                detections.append({
-                    "label": label,
-                    "area_ratio": round(area / total_pixels, 2),
-                    "confidence": float(box.conf)
-                })
-
-        # 根据物体判断五行
-        if detections:
-            wuxing_weights = {"金": 0, "木": 0, "水": 0, "火": 0, "土": 0}
-            reason = ""
-            for obj in detections:
-                mapping = self.WUXING_MAPPING.get(obj["label"], self.WUXING_MAPPING["default"])
-                # for label, weight, name, reason in mapping.items():
-                #     wuxing_weights[label] += weight * obj["area_ratio"]  # 按面积加权
-                #     reason += f"{name}: {reason}"
-                for label, weight in mapping['element'].items():
-                    wuxing_weights[label] += weight * obj["area_ratio"]  # 按面积加权
-                    reason += f"{mapping['name']}: {mapping['reason']}\n"
-
-            main_wuxing = max(wuxing_weights, key=wuxing_weights.get)
-            # return {
-            #     "wuxing": main_wuxing,
-            #     "method": "object",
-            #     "details": {
-            #         "detected_objects": detections,
-            #         "wuxing_weights": wuxing_weights
-            #     }
-            # }
-            score = max(wuxing_weights.values())
-            return {
-                "name": main_wuxing,
-                "reason": reason,
-                "score": score
-            }
+        wuxing = self.score_detections(detections["classes"], box_areas(detections["xyxy"]), detections["conf"],
+                                       h * w, min_area_ratio)
+        if wuxing is not None:
+            return wuxing
 
         # 物体检测失败时降级到颜色分析
-        # return {
-        #     "wuxing": self.color_based_wuxing(img_array),
-        #     "method": "color",
-        #     "reason": "色彩理论"
-        # }
         dominant_color = get_dominant_color(img_array)
         wuxing = color_to_wuxing(dominant_color)
         return wuxing
 
+    @staticmethod
+    def _to_array(image_array):
+        """统一转换为numpy数组"""
+        if isinstance(image_array, Image.Image):
+            import cv2  # 仅PIL输入需要，避免导入时加载OpenCV
 
-    def color_based_wuxing(self, img):
-        """颜色五行分析（HSV空间）"""
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-        # 定义五行颜色范围（HSV）
-        color_ranges = {
-            "木": ((35, 50, 50), (85, 255, 255)),  # 绿色
-            "火": ((0, 100, 100), (20, 255, 255)),  # 红色
-            "土": ((20, 30, 50), (35, 150, 150)),  # 黄色/棕色
-            "金": ((0, 0, 100), (30, 50, 200)),  # 白色/金属色
-            "水": ((85, 50, 50), (120, 255, 255))  # 蓝色
-        }
-
-        # 计算各五行颜色占比
-        element_pixels = {}
-        for element, (lower, upper) in color_ranges.items():
-            mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-            element_pixels[element] = mask.sum()
+            img_array = np.array(image_array)
+            img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)  # PIL转OpenCV格式
+        elif isinstance(image_array, np.ndarray):
+            img_array = image_array  # 检测不会修改输入，无需复制
+        else:
+            raise ValueError("Unsupported image type. Expected PIL.Image or numpy array.")
+        return img_array
 
-        return max(element_pixels, key=element_pixels.get)
+    def color_based_wuxing(self, img):
+        """颜色五行分析：逐像素五行直方图中占比最高的五行"""
+        rgb = img[..., 2::-1]  # OpenCV的BGR转RGB（视图，不复制）
+        elements = color_stats(rgb, with_elements=True)["elements"]
+        return max(ELEMENTS, key=elements.get)
 
 
 # # 示例调用
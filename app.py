@@ -1,180 +1,372 @@
-import gradio as gr
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-
+import base64
+import hashlib
 import json
+import logging
 import os
-
-from analyzer.luoshu import LuoshuAnalyzer
-from analyzer.wuxing_detector import WuxingDetector
-from utils.report_format import ReportFormatter
-
-
-
-def draw_ninehalls(img):
-    # 加载八卦配置
-    with open('data/jiugong.json', 'r', encoding='utf-8') as f:
-        bagua_config = json.load(f)['grids']
-
-    width, height = img.size
-    grid_img = img.copy()
-    draw = ImageDraw.Draw(grid_img)
-
-    font_size = min(width, height) // 25
-
-    # 设置中文字体（建议使用支持中文的字体文件）
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from analyzer.animation import FRAME_DIFF_THRESHOLD, analyze_animation, iter_animation
+from analyzer.pipeline import analyze_array, iter_analysis
+from analyzer.registry import ModelRegistry, current_rss_mb
+from utils import tracing
+from utils.cache import NearDuplicateIndex, ResultCache, evict_oldest, file_key, image_key
+from utils.ingest import is_animated, iter_frames, load_image
+from utils.overlay import encode_overlay
+
+# gradio / fastapi / uvicorn / ultralytics 都推迟到真正启动服务或加载模型时再导入，
+# 其它模块（批处理、测试脚本）import app 时不再为它们付出数秒的启动时间
+logger = logging.getLogger(__name__)
+
+# 推理后端：NINEHALLS_BACKEND可选torch/onnx/openvino，NINEHALLS_INT8=1启用INT8量化
+BACKEND = os.environ.get("NINEHALLS_BACKEND", "torch")
+INT8 = os.environ.get("NINEHALLS_INT8") == "1"
+# 并发请求的YOLO推理合并成批；NINEHALLS_BATCH_SIZE=1时不合批，
+# 但推理仍经由调度线程逐张执行（共用的YOLO模型不是线程安全的）
+CONCURRENCY = int(os.environ.get("NINEHALLS_CONCURRENCY", 8))
+BATCH_SIZE = int(os.environ.get("NINEHALLS_BATCH_SIZE", 8))
+BATCH_WAIT_MS = float(os.environ.get("NINEHALLS_BATCH_WAIT_MS", 5))
+
+# 单宫结果缓存的条目数（按宫位像素复用），默认关闭：整图检测仍每次都要跑，
+# 只有反复上传局部修改的同一张头像时才省时间，新图片反而多付九宫哈希的开销
+PALACE_CACHE_ITEMS = int(os.environ.get("NINEHALLS_PALACE_CACHE", 0))
+
+# 动图/短视频：每秒采样帧数、最多分析的帧数、跳帧的画面变化阈值
+FRAME_FPS = float(os.environ.get("NINEHALLS_FRAME_FPS", 2))
+MAX_FRAMES = int(os.environ.get("NINEHALLS_MAX_FRAMES", 30))
+FRAME_DIFF = float(os.environ.get("NINEHALLS_FRAME_DIFF", FRAME_DIFF_THRESHOLD))
+
+# 叠加图输出：缩小到展示尺寸后按指定格式（webp/jpeg/png）编码一次，编码结果随分析结果缓存
+OVERLAY_MAX_SIDE = int(os.environ.get("NINEHALLS_OVERLAY_MAX_SIDE", 768))
+OVERLAY_FORMAT = os.environ.get("NINEHALLS_OVERLAY_FORMAT", "webp").lower()
+OVERLAY_QUALITY = int(os.environ.get("NINEHALLS_OVERLAY_QUALITY", 80))
+# 交给Gradio发送的叠加图文件（按内容命名），总大小超过NINEHALLS_OVERLAY_DIR_MB时删除最久未用的
+OVERLAY_DIR = os.path.join(tempfile.gettempdir(), "ninehalls_overlays")
+OVERLAY_DIR_MAX_BYTES = int(os.environ.get("NINEHALLS_OVERLAY_DIR_MB", 64)) * 1024 * 1024
+
+# 分析结果缓存：NINEHALLS_CACHE_DIR指定时启用磁盘层
+result_cache = ResultCache(
+    max_items=int(os.environ.get("NINEHALLS_CACHE_ITEMS", 64)),
+    disk_dir=os.environ.get("NINEHALLS_CACHE_DIR"),
+    disk_max_bytes=int(os.environ.get("NINEHALLS_CACHE_MB", 512)) * 1024 * 1024,
+)
+
+# 近重复索引：缩放、重新压缩、去掉元数据的同一张头像也能命中缓存（多进程共用，重启后仍有效）
+# 指定了NINEHALLS_CACHE_DIR时默认放在其中，也可用NINEHALLS_DEDUP_INDEX另外指定；
+# NINEHALLS_DEDUP_DISTANCE为感知哈希的汉明距离阈值（共128位），-1为关闭
+DEDUP_INDEX = os.environ.get("NINEHALLS_DEDUP_INDEX") or (
+    os.path.join(result_cache.disk_dir, "near_duplicates.idx") if result_cache.disk_dir else None)
+DEDUP_DISTANCE = int(os.environ.get("NINEHALLS_DEDUP_DISTANCE", 6))
+DEDUP_CAPACITY = int(os.environ.get("NINEHALLS_DEDUP_CAPACITY", 65536))
+near_duplicates = (NearDuplicateIndex(DEDUP_INDEX, DEDUP_CAPACITY, DEDUP_DISTANCE)
+                   if DEDUP_INDEX and DEDUP_DISTANCE >= 0 else None)
+
+# 网页端与JSON接口共用的并发上限：同时分析的图片总数不超过NINEHALLS_CONCURRENCY
+_analysis_slots = threading.BoundedSemaphore(CONCURRENCY)
+
+# JSON接口：每个请求最多上传的文件数与总大小，超出时在解码前拒绝（413）
+API_MAX_FILES = int(os.environ.get("NINEHALLS_API_MAX_FILES", 16))
+API_MAX_BYTES = int(os.environ.get("NINEHALLS_API_MAX_MB", 20)) * 1024 * 1024
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """首次调用时加载模型，所有请求共用（main()在开始监听前调用并预热）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = ModelRegistry.get(backend=BACKEND, int8=INT8)
+                registry.enable_batching(max(1, BATCH_SIZE), BATCH_WAIT_MS if BATCH_SIZE > 1 else 0)
+                if PALACE_CACHE_ITEMS > 0:
+                    registry.enable_palace_cache(PALACE_CACHE_ITEMS)
+                _registry = registry
+    return _registry
+
+
+def _fingerprint():
+    """缓存键的指纹：模型与配置，以及叠加图的输出设置（缓存中保存的是编码后的叠加图）"""
+    return f"{get_registry().fingerprint}|{OVERLAY_MAX_SIDE}|{OVERLAY_FORMAT}|{OVERLAY_QUALITY}"
+
+
+def _encode(overlay):
+    """叠加图（PIL）编码为输出格式；为空或已编码时原样返回"""
+    if overlay is None or isinstance(overlay, dict):
+        return overlay
+    with tracing.stage("overlay_encode"):
+        return encode_overlay(overlay, OVERLAY_MAX_SIDE, OVERLAY_FORMAT, OVERLAY_QUALITY)
+
+
+def _overlay_file(encoded):
+    """
+    编码后的叠加图写入临时目录，作为Gradio的图片输出（文件直接发送，Gradio不再重新编码）
+    每次调用计入一次响应的叠加图字节数
+    """
+    if encoded is None:
+        return None
+    tracing.count("overlay_bytes", len(encoded["data"]))
+    name = f"{hashlib.sha1(encoded['data']).hexdigest()}.{encoded['mime'].split('/')[1]}"
+    path = os.path.join(OVERLAY_DIR, name)
     try:
-        cn_font = ImageFont.truetype("data/fonts/simhei.ttf", font_size) if os.name == 'nt' else ImageFont.truetype("NotoSansCJK-Regular.ttc", font_size)
-    except:
-        cn_font = ImageFont.load_default()  # 备用默认字体
-
-        # 八卦符号用Segoe UI Symbol（仅Windows）
-    symbol_font = ImageFont.truetype("data/fonts/seguisym.ttf", font_size) if os.name == 'nt' else cn_font
-
-    # 绘制九宫格线（红色虚线效果）
-    dash_pattern = [8, 4]  # 实线8px，空白4px
-    for i in range(1, 3):
-        # 竖线（虚线）
-        for y in range(0, height, sum(dash_pattern)):
-            draw.line([(width * i // 3, y), (width * i // 3, y + dash_pattern[0])],
-                      fill="#FF0000", width=2)
-        # 横线（虚线）
-        for x in range(0, width, sum(dash_pattern)):
-            draw.line([(x, height * i // 3), (x + dash_pattern[0], height * i // 3)],
-                      fill="#FF0000", width=2)
-
-    # 为每个格子添加标记
-    for i in range(3):
-        for j in range(3):
-            idx = i * 3 + j
-            config = bagua_config[idx]
-
-            # 计算当前格子中心坐标
-            x_center = width * (j + 0.5) / 3
-            y_center = height * (i + 0.5) / 3
-
-            # 绘制半透明背景圆角矩形
-            bg_width = width // 4
-            bg_height = height // 8
-            draw.rounded_rectangle(
-                [(x_center - bg_width // 2, y_center - bg_height // 2),
-                 (x_center + bg_width // 2, y_center + bg_height // 2)],
-                radius=10, fill=(0, 0, 0, 50)  # 半透明黑色背景
-            )
-
-            # 第一行：分开渲染八卦符号（默认字体）和宫位名（黑体）
-            symbol_width = draw.textlength(config['symbol'], font=symbol_font)
-            total_width = symbol_width + draw.textlength(config['name'], font=cn_font)
-
-            # 先绘制八卦符号
-            draw.text(
-                (x_center - total_width / 2, y_center - bg_height / 4),
-                config['symbol'],
-                font=symbol_font,
-                fill="white",
-                anchor="lt"
-            )
-            # 再绘制中文宫位名
-            draw.text(
-                (x_center - total_width / 2 + symbol_width, y_center - bg_height / 4),
-                config['name'],
-                font=cn_font,
-                fill="white",
-                anchor="lt"
-            )
-
-            # 第二行：方位 + 五行（如：北方·水）
-            sub_text = f"{config['position']}方·{config['element']}"
-            draw.text((x_center, y_center + bg_height // 5),
-                      sub_text, font=cn_font, fill="#AAAAAA", anchor="mm")
-
-            # 在格子角落添加小字提示（如：财运）
-            corner_text = config["meaning"]
-            corner_x = width * (j + 0.2) / 3
-            corner_y = height * (i + 0.2) / 3
-            draw.text((corner_x, corner_y), corner_text,
-                      font=cn_font, fill="#FFCC00", anchor="lt")
-
-    return grid_img
-
+        os.utime(path)  # 已存在：刷新修改时间，供淘汰时判断
+    except FileNotFoundError:
+        os.makedirs(OVERLAY_DIR, exist_ok=True)
+        # 先为新文件腾出空间；Gradio在产出后立即把文件复制到自己的缓存，这里只需保留最近用过的
+        evict_oldest(OVERLAY_DIR, max(0, OVERLAY_DIR_MAX_BYTES - len(encoded["data"])))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded["data"])
+        os.replace(tmp_path, path)  # 并发请求同一张图时不会读到半个文件
+    return path
+
+
+def _lookup(image):
+    """解码图片并查询结果缓存，返回 (图片array, 缓存键, 缓存结果或None)"""
+    # 解码时即限制分辨率，后续流程不再处理原始大图
+    with tracing.stage("decode"):
+        image = load_image(image)
+
+    # 同一张图（像素相同）直接返回缓存结果，否则再按感知哈希查找近重复的图片
+    with tracing.stage("cache_lookup"):
+        fingerprint = _fingerprint()
+        cache_key = image_key(image, fingerprint)
+        # 近重复查找时精确键未命中不单独计数，整次查询只计一次命中/未命中
+        cached = result_cache.get(cache_key, record=near_duplicates is None)
+        if near_duplicates is not None:
+            if cached is None:
+                match = near_duplicates.lookup(near_duplicates.signature(image), fingerprint)
+                if match is not None:
+                    cached = result_cache.get(match[0], record=False)
+                if cached is not None:
+                    tracing.count("near_duplicate_hit")
+                    logger.info("近重复图片命中缓存：汉明距离%d", match[1])
+                    result_cache.put(cache_key, cached)
+            result_cache.record(cached is not None)
+    tracing.count("cache_hit" if cached is not None else "cache_miss")
+    logger.info("结果缓存%s：%s", "命中" if cached is not None else "未命中", result_cache.stats())
+    return image, cache_key, cached
+
+
+def _store(image, cache_key, result):
+    """缓存分析结果，并登记到近重复索引"""
+    result_cache.put(cache_key, result)
+    if near_duplicates is not None:
+        near_duplicates.add(near_duplicates.signature(image), cache_key, _fingerprint())
+
+
+def _animation_key(source):
+    """动图/视频按文件内容与采样参数做缓存键；非文件输入不缓存"""
+    if not isinstance(source, (str, os.PathLike)):
+        return None
+    return file_key(source, f"{_fingerprint()}|{FRAME_FPS}|{MAX_FRAMES}|{FRAME_DIFF}")
+
+
+def _animation_lookup(source):
+    """查询动图/视频的结果缓存，返回 (缓存键或None, 缓存结果或None)"""
+    with tracing.stage("cache_lookup"):
+        cache_key = _animation_key(source)
+        cached = result_cache.get(cache_key) if cache_key else None
+    tracing.count("cache_hit" if cached is not None else "cache_miss")
+    return cache_key, cached
+
+
+def _animation_stream(source, trace=None):
+    """
+    动图/短视频：逐帧采样分析，每分析一帧更新一次进度，最后产出合并后的结果
+    每次产出 (叠加图, 报告文本, 五行属性)
+    """
+    cache_key, cached = _animation_lookup(source)
+    if cached is not None:
+        yield _overlay_file(cached["overlay"]), cached["report"], cached["wuxing"]["name"]
+        return
+
+    frames = iter_frames(source, FRAME_FPS, MAX_FRAMES)
+    encoded = overlay_path = None  # 第一帧的叠加图，只编码一次
+    for key, value in iter_animation(frames, get_registry(), FRAME_DIFF):
+        if encoded is None and value["overlay"] is not None:
+            encoded = _encode(value["overlay"])
+            overlay_path = _overlay_file(encoded)
+        if key == "result":
+            value["overlay"] = encoded
+            if cache_key:
+                result_cache.put(cache_key, value)
+            yield overlay_path, value["report"], value["wuxing"]["name"]
+            return
+        state = "画面无变化，沿用上一帧" if value["skipped"] else f"判定为{value['element']}"
+        yield overlay_path, f"正在分析第{value['time']:.1f}秒的画面：{state}", value["element"]
+        if trace is not None:
+            tracing.resume(trace)
+
+
+def analyze_result(image):
+    """
+    带缓存的完整分析，返回analyze_array格式的结果字典（动图/视频另有"frames"），
+    其中叠加图为encode_overlay编码后的结果
+    网页端非流式调用与JSON接口共用
+    """
+    if is_animated(image):
+        cache_key, result = _animation_lookup(image)
+        if result is None:
+            result = analyze_animation(image, get_registry(), FRAME_FPS, MAX_FRAMES, FRAME_DIFF)
+            result["overlay"] = _encode(result["overlay"])
+            if cache_key:
+                result_cache.put(cache_key, result)
+        return result
+
+    image, cache_key, cached = _lookup(image)
+    if cached is not None:
+        return cached
+
+    result = analyze_array(image, get_registry())
+    result["overlay"] = _encode(result["overlay"])
+    _store(image, cache_key, result)
+    return result
 
 
 # 玄学分析逻辑核心函数
 def analyze_avatar(image):
-    luoshu_analyzer = LuoshuAnalyzer()
-    wuxing_analyzer = WuxingDetector()
-
-    ''' 1. 九宫格切割'''
-
-    img = Image.fromarray(image)
-    grid_img = draw_ninehalls(img)
-
-    ''' 2. 五行属性分析 '''
-    img_array = np.array(img)
-    wuxing = wuxing_analyzer.analyze_wuxing(img_array)
-
-
-    ''' 3. 方位吉凶分析'''
-    results = luoshu_analyzer.analyze_image(image)
-
-    ''' 4. 生成报告 '''
-
-    # 格式化，不组织语言版
-    formatter = ReportFormatter()
-    report = formatter.generate(wuxing, results)
-
-    # 组织语言版
-    # generator = ReportGenerator()
-    # report = generator.generate_report()
-    # print(generator.generate_report())
-
-    return grid_img, report, wuxing['name']
-
-
-# Gradio界面设计
-with gr.Blocks(title="赛博看相：头像玄学检测器", theme=gr.themes.Soft()) as app:
-    gr.Markdown("## 🔮 赛博看相：你的头像在玄学中是好是坏？上传检测！")
-
-    with gr.Row():
-        with gr.Column():
-            upload_btn = gr.UploadButton("📁 上传头像", file_types=["image"])
-            img_input = gr.Image(label="原始头像", visible=False)
-            with gr.Row():
-                analyze_btn = gr.Button("🔄 开始分析", variant="primary")
-                clear_btn = gr.Button("🧹 清空结果")
-
-        with gr.Column():
-            img_output = gr.Image(label="后天八卦九宫格（倒置）")
-            result_text = gr.Textbox(label="玄学报告", interactive=False)
-            wuxing_badge = gr.Label(label="五行属性")
-
-
-    # 交互逻辑
-    def update_image(file):
-        if file is None:
-            return None, None, None, None
-        return file.name, file.name, None, None
-
-
-    upload_btn.upload(
-        fn=update_image,
-        inputs=upload_btn,
-        outputs=[img_input, img_output, result_text, wuxing_badge]
-    )
-
-    analyze_btn.click(
-        fn=analyze_avatar,
-        inputs=img_input,
-        outputs=[img_output, result_text, wuxing_badge]
-    )
-
-    clear_btn.click(
-        fn=lambda: [None, None, None, None],
-        outputs=[img_input, img_output, result_text, wuxing_badge]
-    )
-
-    # 添加社交分享按钮
-    gr.Markdown("""
+    with _analysis_slots, tracing.request("analyze_avatar"):
+        result = analyze_result(image)
+        return _overlay_file(result["overlay"]), result["report"], result["wuxing"]["name"]
+
+
+def analyze_upload(filename, data, with_report=False, with_overlay=False):
+    """
+    JSON接口分析单个上传文件，失败时返回错误信息而不是抛出（与批处理一致，一个文件失败不影响同批的其它文件）
+    :param filename: 上传时的文件名（按扩展名识别短视频）
+    :param data: 文件内容
+    :return: {"filename", "wuxing", "grids", "summary", ["frames"], ["report"], ["overlay"]} 或 {"filename", "error"}
+    """
+    record = {"filename": filename}
+    # 落盘后按路径分析：动图/视频的缓存与解码都基于文件，和网页端上传走同一条路径
+    suffix = os.path.splitext(filename or "")[1].lower()
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(data)
+    try:
+        with _analysis_slots, tracing.request("api_analyze"):
+            result = analyze_result(f.name)
+            record.update(get_registry().formatter.generate_data(result["wuxing"], result["grids"]))
+            if "frames" in result:
+                record["frames"] = result["frames"]
+            if with_report:
+                record["report"] = result["report"]
+            if with_overlay:
+                record["overlay"] = _overlay_data_url(result["overlay"])
+    except Exception as e:
+        logger.warning("接口分析失败：%s（%s）", filename, e)
+        return {"filename": filename, "error": f"{type(e).__name__}: {str(e).replace(f.name, filename or '')}"}
+    finally:
+        os.remove(f.name)
+    return record
+
+
+def _overlay_data_url(encoded):
+    """编码后的叠加图转为data URL"""
+    if encoded is None:
+        return None
+    tracing.count("overlay_bytes", len(encoded["data"]))
+    return f"data:{encoded['mime']};base64," + base64.b64encode(encoded["data"]).decode()
+
+
+def analyze_avatar_stream(image):
+    """
+    流式版analyze_avatar：先给出叠加图，一次推理后给出核心五行，之后每算完一宫更新一次报告
+    每次产出 (叠加图, 报告文本, 五行属性)，最后一次与analyze_avatar的返回值相同
+    """
+    # 生成器可能在另一个线程中继续执行，信号量（不同于Lock）允许在其它线程释放
+    with _analysis_slots, tracing.request("analyze_avatar_stream") as trace:
+        if is_animated(image):
+            yield from _animation_stream(image, trace)
+            return
+
+        image, cache_key, cached = _lookup(image)
+        if cached is not None:
+            yield _overlay_file(cached["overlay"]), cached["report"], cached["wuxing"]["name"]
+            return
+
+        registry = get_registry()
+        result = {"wuxing": None, "grids": [], "report": None, "overlay": None}
+        overlay_path = None
+        for key, value in iter_analysis(image, registry):
+            if key == "overlay":
+                value = _encode(value)
+                overlay_path = _overlay_file(value)
+            if key == "grid":
+                result["grids"].append(value)
+            else:
+                result[key] = value
+            if key != "report":
+                wuxing = result["wuxing"]
+                yield (overlay_path, registry.formatter.generate_progress(wuxing, result["grids"]),
+                       wuxing["name"] if wuxing else None)
+                tracing.resume(trace)  # Gradio可能在另一个线程中继续执行生成器
+
+        _store(image, cache_key, result)
+        yield overlay_path, result["report"], result["wuxing"]["name"]
+
+
+def build_app():
+    """构建Gradio界面"""
+    import gradio as gr
+
+    # Gradio界面设计
+    with gr.Blocks(title="赛博看相：头像玄学检测器", theme=gr.themes.Soft()) as app:
+        gr.Markdown("## 🔮 赛博看相：你的头像在玄学中是好是坏？上传检测！")
+
+        with gr.Row():
+            with gr.Column():
+                upload_btn = gr.UploadButton("📁 上传头像", file_types=["image"])
+                # image_mode=None：Gradio直接传原文件路径，不先整图解码转RGB再写入缓存，转换统一由load_image完成
+                img_input = gr.Image(label="原始头像", visible=False, type="filepath", image_mode=None)
+                with gr.Row():
+                    analyze_btn = gr.Button("🔄 开始分析", variant="primary")
+                    clear_btn = gr.Button("🧹 清空结果")
+
+            with gr.Column():
+                img_output = gr.Image(label="后天八卦九宫格（倒置）")
+                result_text = gr.Textbox(label="玄学报告", interactive=False)
+                wuxing_badge = gr.Label(label="五行属性")
+
+
+        # 交互逻辑
+        def update_image(file):
+            if file is None:
+                return None, None, None, None
+            return file.name, file.name, None, None
+
+
+        upload_btn.upload(
+            fn=update_image,
+            inputs=upload_btn,
+            outputs=[img_input, img_output, result_text, wuxing_badge]
+        )
+
+        def analyze_stream(image):
+            # 叠加图只在第一次产出时发送，之后的每次更新只刷新报告与五行
+            sent = None
+            for overlay, report, element in analyze_avatar_stream(image):
+                yield (gr.skip() if overlay is sent else overlay), report, element
+                sent = overlay
+
+        # 实际的并发上限是与JSON接口共用的_analysis_slots；这里的限制只让排队的请求在Gradio队列中
+        # 显示排队位置，而不是占着工作线程等待
+        analyze_btn.click(
+            fn=analyze_stream,
+            inputs=img_input,
+            outputs=[img_output, result_text, wuxing_badge],
+            concurrency_limit=CONCURRENCY
+        )
+
+        clear_btn.click(
+            fn=lambda: [None, None, None, None],
+            outputs=[img_input, img_output, result_text, wuxing_badge]
+        )
+
+        # 添加社交分享按钮
+        gr.Markdown("""
     <div style="text-align: center">
         <p>分享你的分析结果：</p>
         <a href='https://twitter.com/intent/tweet?text=我的头像玄学报告：' target='_blank'>
@@ -182,5 +374,128 @@ with gr.Blocks(title="赛博看相：头像玄学检测器", theme=gr.themes.Sof
         </a>
     </div>
     """)
-
-app.launch()
\ No newline at end of file
+    return app
+
+
+class _UploadLimit:
+    """
+    ASGI中间件：边接收边累计指定路径的请求体字节数，超过上限立即返回413并断开，
+    多余的内容不会被multipart解析、写入临时文件（有Content-Length时收到请求头就拒绝）
+    """
+
+    def __init__(self, app, path, max_bytes):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+
+        started = rejected = False
+        received = 0
+
+        async def reject():
+            nonlocal started, rejected
+            rejected = True
+            if not started:
+                started = True
+                body = json.dumps({"detail": f"上传总大小超过{self.max_bytes // 1024 // 1024}MB"},
+                                  ensure_ascii=False).encode()
+                await send({"type": "http.response.start", "status": 413,
+                            "headers": [(b"content-type", b"application/json"), (b"connection", b"close"),
+                                        (b"content-length", str(len(body)).encode())]})
+                await send({"type": "http.response.body", "body": body})
+
+        # multipart的分隔行与字段头另有少量开销，这里留出余量
+        limit = self.max_bytes + 64 * 1024
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            return await reject()
+
+        async def limited_receive():
+            nonlocal received
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # 后续由接口返回的解析错误不再发送
+                    await reject()
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if rejected:
+                return
+            started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+
+def build_server(app):
+    """
+    网页与接口共用一个服务：Gradio挂载在根路径，/metrics输出Prometheus格式指标，
+    /api/analyze为JSON接口（multipart上传一张或多张图片，字段名files）
+    """
+    import gradio as gr
+    from fastapi import FastAPI, File, HTTPException, UploadFile
+    from fastapi.responses import PlainTextResponse
+
+    server = FastAPI()
+    server.add_middleware(_UploadLimit, path="/api/analyze", max_bytes=API_MAX_BYTES)
+
+    @server.get("/metrics")
+    def metrics():
+        return PlainTextResponse(tracing.METRICS.render(), media_type="text/plain; version=0.0.4")
+
+    @server.post("/api/analyze")
+    def api_analyze(files: list[UploadFile] = File(...), report: bool = False, overlay: bool = False):
+        """
+        curl -F files=@a.jpg -F files=@b.png "http://127.0.0.1:7860/api/analyze?report=true"
+        :param report: 是否附带报告文本
+        :param overlay: 是否附带九宫格叠加图（data URL）
+        :return: {"results": 按上传顺序每个文件一项（见analyze_upload）}
+        """
+        if len(files) > API_MAX_FILES:
+            raise HTTPException(413, f"每次最多上传{API_MAX_FILES}个文件")
+        # 同步函数由FastAPI放到线程池执行，不阻塞Gradio的事件循环；
+        # 总大小已由_UploadLimit在接收请求体时限制
+        uploads = [(upload.filename, upload.file.read()) for upload in files]
+        for filename, data in uploads:
+            if not data:
+                raise HTTPException(422, f"文件为空：{filename}")
+        # 同一请求的多个文件并行分析，YOLO推理可与其它请求合批
+        with ThreadPoolExecutor(max(1, min(len(uploads), CONCURRENCY))) as pool:
+            results = pool.map(lambda item: analyze_upload(*item, report, overlay), uploads)
+            return {"results": list(results)}
+
+    return gr.mount_gradio_app(server, app, path="")
+
+
+def main():
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    # 开始监听前加载并预热模型，第一个请求不再承担初始化开销
+    registry = get_registry().warmup()
+
+    # /metrics 导出的仪表值（抓取时读取）
+    tracing.METRICS.gauge("result_cache", result_cache.stats)
+    tracing.METRICS.gauge("inference_scheduler",
+                          lambda: registry.detector.scheduler.stats() if registry.detector.scheduler else None)
+    tracing.METRICS.gauge("palace_cache",
+                          lambda: registry.luoshu.palace_cache.stats() if registry.luoshu.palace_cache else None)
+    tracing.METRICS.gauge("near_duplicates", lambda: near_duplicates.stats() if near_duplicates else None)
+    tracing.METRICS.gauge("rss_mb", current_rss_mb)
+
+    uvicorn.run(build_server(build_app()),
+                host=os.environ.get("GRADIO_SERVER_NAME", "127.0.0.1"),
+                port=int(os.environ.get("GRADIO_SERVER_PORT", 7860)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+命令行批量分析：不启动网页，逐张输出JSON行
+
+用法：
+    python batch.py 头像目录 -o results.jsonl --workers 4
+    python batch.py manifest.txt -o results.jsonl --report
+
+输入可以是目录（递归查找图片）或清单文件：
+    .txt   每行一个图片路径
+    .jsonl 每行 {"id": ..., "path": ...}
+输出文件已存在时按id跳过已成功的图片，崩溃后重新运行即可续跑；失败的图片续跑时重试，
+同一id有多行时以最后一行为准。
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from utils.ingest import VIDEO_EXTENSIONS
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.gif', '.tif', '.tiff'}
+# 目录输入时一并收集短视频头像，与动图一样逐帧采样分析
+INPUT_EXTENSIONS = IMAGE_EXTENSIONS | set(VIDEO_EXTENSIONS)
+
+logger = logging.getLogger("batch")
+
+# 每个工作进程各自持有一份预热好的模型
+_registry = None
+
+
+def iter_inputs(source):
+    """遍历输入，产出 (id, 路径)"""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in INPUT_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, source), path
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if source.endswith('.jsonl'):
+                item = json.loads(line)
+                path = item['path']
+                image_id = str(item.get('id', path))
+            else:
+                path = image_id = line
+            yield image_id, path if os.path.isabs(path) else os.path.join(base, path)
+
+
+def load_done_ids(output_path):
+    """
+    读取已有输出中成功分析的id；失败的记录（含"error"）不算完成，续跑时重试
+    崩溃时写了一半的最后一行直接忽略
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                if 'error' not in record:
+                    done.add(record['id'])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+    return done
+
+
+def _init_worker(yolo_path, backend="torch", int8=False, threads=None):
+    """
+    :param threads: 每个进程的计算线程数，None时不限制
+    """
+    global _registry
+    if threads is not None:
+        # 每个进程默认按全部核数开线程池，多进程时互相争抢CPU，按进程数平分
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    from analyzer.registry import ModelRegistry
+    _registry = ModelRegistry.get(yolo_path=yolo_path, backend=backend, int8=int8).warmup()
+
+
+def _analyze(task):
+    """工作进程中分析单张图片（动图/短视频按帧采样后合并），异常也作为结果返回"""
+    from analyzer.animation import analyze_animation
+    from analyzer.pipeline import analyze_array
+    from utils.ingest import is_animated, load_image
+
+    image_id, path, with_report, (sample_fps, max_frames) = task
+    start = time.perf_counter()
+    record = {"id": image_id, "path": path}
+    try:
+        if is_animated(path):
+            result = analyze_animation(path, _registry, sample_fps, max_frames, overlay=False)
+            record["frames"] = result["frames"]
+        else:
+            image = load_image(path)
+            result = analyze_array(image, _registry, overlay=False)
+        record["wuxing"] = result["wuxing"]
+        record["grids"] = result["grids"]
+        if with_report:
+            record["report"] = result["report"]
+    except Exception as e:  # 单张失败不影响整批
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _imap_unordered(executor, fn, tasks, max_pending):
+    """
+    按完成顺序产出结果，同时最多提交max_pending个任务（任务很多时不必一次全部放进队列）
+    工作进程异常退出（被OOM终止、段错误）时抛出BrokenProcessPool，而不是像Pool.imap_unordered那样永远等下去
+    """
+    tasks = iter(tasks)
+    pending = set()
+    while True:
+        for task in tasks:
+            pending.add(executor.submit(fn, task))
+            if len(pending) >= max_pending:
+                break
+        if not pending:
+            return
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            yield future.result()
+
+
+def _json_default(obj):
+    """numpy标量等非标准类型转为Python原生类型"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"无法序列化：{type(obj).__name__}")
+
+
+def run(source, output_path, workers=os.cpu_count(), yolo_path='yolo11n.pt', with_report=False,
+        backend="torch", int8=False, sample_fps=2.0, max_frames=60):
+    done = load_done_ids(output_path)
+    frame_options = (sample_fps, max_frames)
+    tasks = [(image_id, path, with_report, frame_options) for image_id, path in iter_inputs(source)
+             if image_id not in done]
+    logger.info("共%d张待分析，跳过已完成%d张", len(tasks), len(done))
+    if not tasks:
+        return
+
+    if backend != "torch":
+        # 先在主进程导出一次，避免多个工作进程同时导出
+        from analyzer.backends import export_model
+        export_model(yolo_path, backend, int8)
+
+    start = time.perf_counter()
+    failed = 0
+    with open(output_path, 'a', encoding='utf-8') as out:
+        if workers <= 0:
+            # 不开进程池，便于调试
+            _init_worker(yolo_path, backend, int8)
+            results = map(_analyze, tasks)
+            pool = None
+        else:
+            # spawn避免fork后共享torch线程池导致的死锁
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(yolo_path, backend, int8, threads))
+            results = _imap_unordered(pool, _analyze, tasks, workers * 4)
+
+        i = 0
+        try:
+            for i, record in enumerate(results, 1):
+                failed += 'error' in record
+                out.write(json.dumps(record, ensure_ascii=False, default=_json_default) + "\n")
+                out.flush()
+                if i % 100 == 0 or i == len(tasks):
+                    elapsed = time.perf_counter() - start
+                    logger.info("进度 %d/%d，失败%d，%.1f张/秒", i, len(tasks), failed, i / elapsed)
+        except BrokenProcessPool:
+            logger.error("工作进程异常退出（可能被OOM终止或崩溃），已完成%d/%d张，重新运行即可续跑；"
+                         "反复在同一处崩溃时可用 --workers 0 定位出问题的文件", i, len(tasks))
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="头像玄学批量分析（JSONL输出）")
+    parser.add_argument("source", help="图片目录，或清单文件（.txt每行一个路径 / .jsonl含id与path）")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="输出JSONL文件（已存在时续跑）")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="工作进程数，0为在当前进程中运行；每个进程的torch/OpenMP线程数为CPU核数÷进程数")
+    parser.add_argument("--yolo", default="yolo11n.pt", help="YOLO模型路径")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "openvino"],
+                        help="推理后端（非torch时首次运行会导出模型）")
+    parser.add_argument("--int8", action="store_true", help="使用INT8量化模型（仅onnx/openvino）")
+    parser.add_argument("--report", action="store_true", help="输出中包含报告文本")
+    parser.add_argument("--sample-fps", type=float, default=2.0, help="动图/短视频每秒采样的帧数")
+    parser.add_argument("--max-frames", type=int, default=60, help="动图/短视频最多采样的帧数")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    run(args.source, args.output, args.workers, args.yolo, args.report, args.backend, args.int8,
+        args.sample_fps, args.max_frames)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
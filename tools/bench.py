@@ -0,0 +1,182 @@
+"""
+分阶段性能基准
+
+用法：
+    python tools/bench.py                       # 运行并与基线对比，有阶段退化则以非零状态退出
+    python tools/bench.py --update              # 运行并把结果写为新基线
+    python tools/bench.py --stages analyze_image draw_ninehalls --sizes 640 2048
+
+测试图片为 testdatas/cat.png 及若干分辨率的合成图（固定随机种子）。
+每个阶段统计中位数、P95耗时和峰值内存（tracemalloc，仅统计Python/NumPy分配，不含torch内部内存；
+峰值内存单独运行一次统计，计时不受tracemalloc开销影响）。
+基线默认保存在 tools/bench_baseline.json（与机器相关，请在目标机器上生成），
+中位数超过基线的(1+阈值)倍视为退化。
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from analyzer.pipeline import analyze_array  # noqa: E402
+from analyzer.registry import ModelRegistry  # noqa: E402
+from analyzer.wuxing import check_element_harmony  # noqa: E402
+from analyzer.wuxing_detector import WuxingDetector  # noqa: E402
+from utils.ingest import load_image  # noqa: E402
+from utils.overlay import draw_ninehalls, encode_overlay  # noqa: E402
+from utils.region_index import RegionIndex  # noqa: E402
+from utils.utils import color_to_wuxing, get_dominant_color  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, "tools", "bench_baseline.json")
+DEFAULT_SIZES = [256, 640, 1024, 2048]
+
+
+def synthetic_image(size, seed=0):
+    """渐变加噪声的合成图，颜色分布接近真实照片"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    base = np.stack([x * 255, y * 255, (1 - x) * 180 + 40], axis=-1)
+    noise = rng.normal(0, 20, (size, size, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def measure(fn, repeat):
+    """
+    运行repeat次，返回 (耗时列表, 峰值内存字节)
+    tracemalloc会拦截每次分配、明显拖慢计时，所以计时循环不开启，峰值内存另外单独跑一次统计
+    """
+    fn()  # 预热：首次调用的缓存/延迟初始化不计入
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def build_cases(registry, images):
+    """(阶段名, 图片名) -> (函数, 重复次数系数)"""
+    from PIL import Image
+
+    detector = registry.detector
+    luoshu = registry.luoshu
+    formatter = registry.formatter
+    cases = {
+        ("model_load", "-"): (lambda: WuxingDetector(), 0.1),
+        ("color_to_wuxing", "-"): (lambda: color_to_wuxing((180, 120, 60)), 1),
+        ("check_element_harmony", "-"): (lambda: check_element_harmony("火", "金", 62.5), 1),
+    }
+    for name, image in images.items():
+        pil_image = Image.fromarray(image)
+        wuxing = detector.analyze_wuxing(image)
+        grids = luoshu.analyze_image(image)
+        index = RegionIndex(image)
+        cases.update({
+            ("draw_ninehalls", name): (lambda p=pil_image: draw_ninehalls(p), 1),
+            ("encode_overlay", name): (lambda o=draw_ninehalls(pil_image): encode_overlay(o), 1),
+            ("get_dominant_color", name): (lambda a=image: get_dominant_color(a), 1),
+            ("analyze_wuxing", name): (lambda a=image: detector.analyze_wuxing(a), 1),
+            ("analyze_image", name): (lambda a=image: luoshu.analyze_image(a), 0.5),
+            ("region_index", name): (lambda a=image: RegionIndex(a), 1),
+            ("grid_stats_9x9", name): (lambda i=index: i.grid_stats(9), 1),
+            ("hot_spots", name): (lambda i=index, s=max(8, image.shape[0] // 8): i.hot_spots("火", s), 1),
+            ("report_generate", name): (lambda w=wuxing, g=grids: formatter.generate(w, g), 1),
+            ("pipeline", name): (lambda a=image: analyze_array(a, registry), 0.5),
+        })
+    return cases
+
+
+def run(stages, sizes, repeat):
+    registry = ModelRegistry.get().warmup()
+    images = {"cat.png": load_image(os.path.join(ROOT, "testdatas", "cat.png"))}
+    for size in sizes:
+        images[f"{size}px"] = synthetic_image(size)
+
+    results = {}
+    for (stage, image_name), (fn, factor) in build_cases(registry, images).items():
+        if stages and stage not in stages:
+            continue
+        times, peak = measure(fn, max(1, int(repeat * factor)))
+        key = f"{stage}@{image_name}"
+        results[key] = {
+            "median_ms": round(float(np.median(times)) * 1000, 3),
+            "p95_ms": round(float(np.percentile(times, 95)) * 1000, 3),
+            "peak_kb": round(peak / 1024, 1),
+            "runs": len(times),
+        }
+        print(f"{key:<36} 中位数 {results[key]['median_ms']:>9.2f}ms  "
+              f"P95 {results[key]['p95_ms']:>9.2f}ms  峰值内存 {results[key]['peak_kb']:>10.1f}KB")
+    return results
+
+
+def compare(results, baseline, threshold, min_delta_ms=0.5):
+    """返回退化的阶段列表；绝对差值小于min_delta_ms的亚毫秒抖动不计"""
+    regressions = []
+    for key, current in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        ratio = current["median_ms"] / max(reference["median_ms"], 1e-6)
+        if ratio > 1 + threshold and current["median_ms"] - reference["median_ms"] >= min_delta_ms:
+            regressions.append(f"{key}: {reference['median_ms']:.2f}ms → {current['median_ms']:.2f}ms"
+                               f"（+{(ratio - 1) * 100:.0f}%）")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分阶段性能基准")
+    parser.add_argument("--stages", nargs="*", help="只运行指定阶段")
+    parser.add_argument("--sizes", nargs="*", type=int, default=DEFAULT_SIZES, help="合成图边长")
+    parser.add_argument("--repeat", type=int, default=20, help="每个阶段的重复次数")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件")
+    parser.add_argument("--threshold", type=float, default=0.2, help="允许的中位数退化比例")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="忽略小于此值的绝对退化")
+    parser.add_argument("--update", action="store_true", help="把本次结果写为基线")
+    args = parser.parse_args(argv)
+
+    results = run(args.stages, args.sizes, args.repeat)
+
+    if args.update:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f).get("stages", {})
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(),
+                       "stages": baseline}, f, ensure_ascii=False, indent=2)
+        print(f"基线已更新：{args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("没有基线文件，使用 --update 生成")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != platform.platform():
+        print(f"注意：基线来自其它机器（{baseline.get('machine')}），对比结果仅供参考")
+    regressions = compare(results, baseline["stages"], args.threshold, args.min_delta_ms)
+    for item in regressions:
+        print(f"[退化] {item}")
+    if not regressions:
+        print(f"[通过] 所有阶段均未超过基线的{args.threshold * 100:.0f}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
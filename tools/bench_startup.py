@@ -0,0 +1,134 @@
+"""
+冷启动基准：模块导入耗时与首个请求延迟
+
+用法：
+    python tools/bench_startup.py                 # 每项在全新子进程中测5次，取中位数
+    python tools/bench_startup.py --repeat 10 --json startup.json
+    python tools/bench_startup.py --importtime 15 # 额外列出 import app 时自身耗时最多的模块
+
+每次测量都启动新的Python进程，结果包含真实的冷启动开销（磁盘缓存除外）：
+- import_<模块>：导入耗时（app、batch、analyzer.registry，以及gradio/ultralytics作参照）
+- model_load / warmup：ModelRegistry加载与预热
+- first_request：导入app后第一次调用analyze_avatar（模型在请求内加载，即未预热时用户看到的延迟）
+- warm_request：预热之后第一个未命中缓存的请求
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, "testdatas", "cat.png")
+
+IMPORT_MODULES = ["app", "batch", "analyzer.registry", "gradio", "ultralytics"]
+
+# 子进程脚本：打印一行JSON，单位秒
+_IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"import": time.perf_counter() - start}}))
+"""
+
+_REQUEST_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.analyze_avatar({sample!r})
+first = time.perf_counter()
+print(json.dumps({{"import_app": imported - start, "first_request": first - imported}}))
+"""
+
+_WARM_SCRIPT = """
+import json, time
+import numpy as np
+import app
+from utils.ingest import load_image
+start = time.perf_counter()
+registry = app.get_registry()
+loaded = time.perf_counter()
+registry.warmup()
+warmed = time.perf_counter()
+app.analyze_avatar(np.ascontiguousarray(load_image({sample!r})[:, ::-1]))  # 镜像图，避开缓存
+print(json.dumps({{"model_load": loaded - start, "warmup": warmed - loaded,
+                  "warm_request": time.perf_counter() - warmed}}))
+"""
+
+
+def run_child(script):
+    """在项目根目录外的新进程中运行脚本，验证不依赖工作目录"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    env.pop("NINEHALLS_CACHE_DIR", None)  # 磁盘缓存会让首个请求直接命中
+    proc = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(ROOT), env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "子进程失败")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def collect(repeat):
+    samples = {}
+
+    def add(values):
+        for key, seconds in values.items():
+            samples.setdefault(key, []).append(seconds * 1000)
+
+    for module in IMPORT_MODULES:
+        for _ in range(repeat):
+            try:
+                add({f"import_{module}": run_child(_IMPORT_SCRIPT.format(module=module))["import"]})
+            except RuntimeError as e:
+                print(f"跳过 import {module}：{e}")
+                break
+    for script in (_REQUEST_SCRIPT, _WARM_SCRIPT):
+        for _ in range(repeat):
+            add(run_child(script.format(sample=SAMPLE)))
+
+    return {key: {"median_ms": round(float(np.median(v)), 1), "max_ms": round(float(np.max(v)), 1),
+                  "runs": len(v)}
+            for key, v in samples.items()}
+
+
+def import_profile(top):
+    """python -X importtime 的自身耗时排行"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                          cwd=os.path.dirname(ROOT), env=env, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷启动基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测量的进程数")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="列出import app时自身耗时最多的N个模块")
+    args = parser.parse_args(argv)
+
+    results = collect(args.repeat)
+    for key, item in results.items():
+        print(f"{key:<28} 中位数 {item['median_ms']:>9.1f}ms  最大 {item['max_ms']:>9.1f}ms")
+
+    if args.importtime:
+        print("\nimport app 自身耗时排行：")
+        for self_us, name in import_profile(args.importtime):
+            print(f"  {self_us / 1000:>8.1f}ms  {name}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+校验推理后端：对比指定后端与PyTorch原生模型的检测结果
+
+用法：
+    python tools/check_backend.py --backend onnx
+    python tools/check_backend.py --backend openvino --int8 --images 头像目录
+
+同一张图中，PyTorch的每个检测框都要在候选后端中找到同类别、IoU不低于阈值、
+置信度差值在容差内的框，且全图五行结论一致，否则以非零状态退出。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from analyzer.wuxing_detector import WuxingDetector  # noqa: E402
+
+
+def box_iou(a, b):
+    """(N,4) 与 (M,4) 两组框的IoU矩阵"""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def compare(reference, candidate, min_conf, iou_threshold, conf_tolerance):
+    """返回未匹配上的参考检测框描述列表"""
+    keep = reference["conf"] >= min_conf
+    ref_xyxy, ref_conf = reference["xyxy"][keep], reference["conf"][keep]
+    ref_labels = [label for label, k in zip(reference["labels"], keep) if k]
+
+    iou = box_iou(ref_xyxy, candidate["xyxy"]) if len(candidate["labels"]) else np.zeros((len(ref_labels), 0))
+    mismatches = []
+    for i, label in enumerate(ref_labels):
+        ok = [
+            j for j, cand_label in enumerate(candidate["labels"])
+            if cand_label == label and iou[i, j] >= iou_threshold
+            and abs(candidate["conf"][j] - ref_conf[i]) <= conf_tolerance
+        ]
+        if not ok:
+            best = float(iou[i].max()) if iou.shape[1] else 0.0
+            mismatches.append(f"{label}（置信度{ref_conf[i]:.2f}，最佳IoU {best:.2f}）")
+    return mismatches
+
+
+def iter_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.bmp')):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比推理后端与PyTorch的检测结果")
+    parser.add_argument("--backend", required=True, choices=["onnx", "openvino"])
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--yolo", default="yolo11n.pt")
+    parser.add_argument("--images", nargs="+", default=[os.path.join(ROOT, "testdatas")],
+                        help="图片文件或目录")
+    parser.add_argument("--min-conf", type=float, default=0.5, help="只校验置信度不低于此值的参考框")
+    parser.add_argument("--iou", type=float, default=0.9, help="框匹配的最小IoU")
+    parser.add_argument("--conf-tol", type=float, default=0.05, help="置信度容差（INT8建议放宽到0.1）")
+    args = parser.parse_args(argv)
+
+    reference = WuxingDetector(yolo_path=args.yolo)
+    candidate = WuxingDetector(yolo_path=args.yolo, backend=args.backend, int8=args.int8)
+
+    failed = 0
+    timings = {"torch": [], args.backend: []}
+    for path in iter_images(args.images):
+        with Image.open(path) as img:
+            image = np.array(img.convert("RGB"))
+
+        results = {}
+        for name, detector in (("torch", reference), (args.backend, candidate)):
+            detector.detect(image)  # 预热
+            start = time.perf_counter()
+            results[name] = detector.detect(image)
+            timings[name].append(time.perf_counter() - start)
+
+        mismatches = compare(results["torch"], results[args.backend],
+                             args.min_conf, args.iou, args.conf_tol)
+        ref_name = reference.analyze_wuxing(image, detections=results["torch"])["name"]
+        cand_name = candidate.analyze_wuxing(image, detections=results[args.backend])["name"]
+        if ref_name != cand_name:
+            mismatches.append(f"五行结论不一致：{ref_name} → {cand_name}")
+
+        status = "通过" if not mismatches else "不一致"
+        print(f"[{status}] {path}")
+        for item in mismatches:
+            print(f"    {item}")
+        failed += bool(mismatches)
+
+    for name, values in timings.items():
+        if values:
+            print(f"{name}: 平均推理 {np.mean(values) * 1000:.1f}ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+检查九宫流程中没有多余的像素复制
+
+用法：
+    python tools/check_copies.py [--size 1024]
+
+1. 每个宫位交给analyze_grid的都是原图的切片视图（np.shares_memory）；
+2. 送入YOLO的整图/宫格就是调用方传入的缓冲区，没有额外复制；
+3. 用tracemalloc统计九宫循环的峰值分配，必须小于一个宫位的像素字节数，
+   即循环中没有任何宫位级别的复制。
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyzer.registry import ModelRegistry  # noqa: E402
+from utils.color_stats import grid_color_stats  # noqa: E402
+
+
+class _RecordingModel:
+    """记录送入模型的数组，再转交真实模型"""
+
+    def __init__(self, model):
+        self.model = model
+        self.inputs = []
+
+    def __call__(self, img_array):
+        self.inputs.append(img_array)
+        return self.model(img_array, verbose=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="检查九宫流程中的像素复制")
+    parser.add_argument("--size", type=int, default=1024, help="测试图片边长")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+
+    registry = ModelRegistry.get()
+    luoshu = registry.luoshu
+    detector = registry.detector
+    recorder = _RecordingModel(detector.model)
+    previous_scheduler, detector.scheduler = detector.scheduler, recorder
+
+    failures = []
+    try:
+        # 1. 宫位视图
+        received = []
+        original_analyze_grid = luoshu.analyze_grid
+
+        def recording_analyze_grid(grid_img, *rest):
+            received.append(grid_img)
+            return original_analyze_grid(grid_img, *rest)
+
+        luoshu.analyze_grid = recording_analyze_grid
+        try:
+            luoshu.analyze_image(image)  # 每宫单独检测的路径
+        finally:
+            del luoshu.analyze_grid
+        copied = [i for i, view in enumerate(received) if not np.shares_memory(view, image)]
+        if copied:
+            failures.append(f"宫位{copied}收到的是复制后的像素")
+
+        # 2. 送入模型的缓冲区
+        recorder.inputs.clear()
+        detector.analyze_wuxing(image)
+        if not all(np.shares_memory(x, image) for x in recorder.inputs):
+            failures.append("analyze_wuxing送入模型前复制了整图")
+
+        # 3. 九宫循环的峰值分配
+        detections = detector.detect(image)
+        palaces = luoshu.split_detections(detections, args.size, args.size)
+        colors = grid_color_stats(image, with_elements=True)
+        palace_bytes = min(view.nbytes for _, view in luoshu.palace_views(image))
+
+        tracemalloc.start()
+        for grid_index, view in luoshu.palace_views(image):
+            luoshu.analyze_grid(view, grid_index, palaces[grid_index], colors[grid_index])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"九宫循环峰值分配：{peak / 1024:.1f}KB（单宫像素 {palace_bytes / 1024:.1f}KB）")
+        if peak >= palace_bytes:
+            failures.append("九宫循环中存在宫位级别的复制")
+    finally:
+        detector.scheduler = previous_scheduler
+
+    for item in failures:
+        print(f"[失败] {item}")
+    if not failures:
+        print("[通过] 九宫流程没有多余的像素复制")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
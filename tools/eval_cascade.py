@@ -0,0 +1,111 @@
+"""
+评估九宫级联模式：均匀宫位跳过YOLO后，结果与每宫都检测时的一致率
+
+用法：
+    python tools/eval_cascade.py                                  # testdatas + 24张合成头像
+    python tools/eval_cascade.py 头像目录 --synthetic 0
+    python tools/eval_cascade.py --max-edge 3 4 6 --max-std 30 40 50   # 网格搜索阈值
+
+对每个阈值组合报告：跳过检测的宫位比例、宫位五行一致率、和谐判断一致率、
+九宫全部一致的图片比例，以及两种模式的总耗时。
+合成头像是在纯色/渐变背景上随机贴一块testdatas中的图片，模拟大面积背景的头像。
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from analyzer.luoshu import LuoshuAnalyzer  # noqa: E402
+from analyzer.registry import ModelRegistry  # noqa: E402
+from batch import iter_inputs  # noqa: E402
+from utils.ingest import DETECT_MAX_SIDE, load_image  # noqa: E402
+
+
+def synthetic_avatars(count, sources, size=512, seed=0):
+    """纯色或渐变背景上贴一块真实图片，产出 (名称, 图片array)"""
+    rng = np.random.default_rng(seed)
+    for k in range(count):
+        color = rng.integers(0, 256, 3)
+        if k % 2:
+            ramp = np.linspace(0.6, 1.0, size)[:, None, None]
+            background = np.broadcast_to(color * ramp, (size, size, 3))
+        else:
+            background = np.broadcast_to(color, (size, size, 3))
+        image = background.astype(np.uint8).copy()
+
+        patch = sources[k % len(sources)]
+        side = int(size * rng.uniform(0.3, 0.6))
+        patch = load_image(patch, side)
+        ph, pw = patch.shape[:2]
+        y, x = rng.integers(0, size - ph + 1), rng.integers(0, size - pw + 1)
+        image[y:y + ph, x:x + pw] = patch
+        yield f"synthetic_{k:02d}", image
+
+
+def run_mode(analyzer, images):
+    """返回 (各图九宫结果, 总耗时秒)"""
+    results = []
+    start = time.perf_counter()
+    for _, image in images:
+        results.append(analyzer.analyze_image(image))
+    return results, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="评估九宫级联模式与每宫检测的一致率")
+    parser.add_argument("sources", nargs="*", default=[os.path.join(ROOT, "testdatas")], help="图片目录")
+    parser.add_argument("--synthetic", type=int, default=24, help="额外生成的合成头像数量")
+    parser.add_argument("--max-edge", nargs="+", type=float, default=[4.0], help="纹理阈值（可给多个）")
+    parser.add_argument("--max-std", nargs="+", type=float, default=[40.0], help="颜色标准差阈值（可给多个）")
+    parser.add_argument("--min-agreement", type=float, help="宫位五行一致率低于此值时以非零状态退出")
+    args = parser.parse_args(argv)
+
+    paths = [path for source in args.sources for _, path in iter_inputs(source)]
+    images = [(os.path.basename(p), load_image(p, DETECT_MAX_SIDE)) for p in paths]
+    if args.synthetic and paths:
+        images.extend(synthetic_avatars(args.synthetic, paths))
+    if not images:
+        print("没有可用的图片")
+        return 1
+
+    registry = ModelRegistry.get().warmup()
+    baseline = LuoshuAnalyzer(config=registry.jiugong, object_detector=registry.detector)
+    reference, reference_time = run_mode(baseline, images)
+    print(f"{len(images)}张图片，每宫检测耗时 {reference_time:.2f}s")
+
+    worst = 1.0
+    for max_edge, max_std in itertools.product(args.max_edge, args.max_std):
+        cascade = LuoshuAnalyzer(config=registry.jiugong, object_detector=registry.detector, cascade=True,
+                                 cascade_max_edge=max_edge, cascade_max_std=max_std)
+        skipped = sum(not cascade.needs_detection(view)
+                      for _, image in images for _, view in cascade.palace_views(image))
+        results, elapsed = run_mode(cascade, images)
+
+        element_match = harmony_match = image_match = 0
+        for ref_grids, grids in zip(reference, results):
+            same = [r["detected_element"] == g["detected_element"] for r, g in zip(ref_grids, grids)]
+            element_match += sum(same)
+            harmony_match += sum(r["is_harmony"] == g["is_harmony"] for r, g in zip(ref_grids, grids))
+            image_match += all(same)
+
+        palaces = len(images) * 9
+        agreement = element_match / palaces
+        worst = min(worst, agreement)
+        print(f"max_edge={max_edge:<5} max_std={max_std:<5} 跳过{skipped / palaces:6.1%}  "
+              f"五行一致{agreement:6.1%}  和谐一致{harmony_match / palaces:6.1%}  "
+              f"整图一致{image_match / len(images):6.1%}  耗时{elapsed:.2f}s（{reference_time / elapsed:.2f}×）")
+
+    if args.min_agreement is not None and worst < args.min_agreement:
+        print(f"[失败] 宫位五行一致率低于{args.min_agreement:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
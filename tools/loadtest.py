@@ -0,0 +1,363 @@
+"""
+本地压测：启动 app.py（或连接已在运行的服务），按设定的并发与到达率上传头像
+
+用法：
+    python tools/loadtest.py                                  # 闭环：8个并发连续发送，共200个请求
+    python tools/loadtest.py --rate 5 --requests 300          # 开环：平均每秒5个请求（泊松到达）
+    python tools/loadtest.py --concurrency 16 --repeat-ratio 0.3 --json run.json
+    python tools/loadtest.py --compare run.json               # 与之前保存的结果对比
+    python tools/loadtest.py --env NINEHALLS_BATCH_SIZE=1     # 传给被测服务的环境变量（可给多个）
+    python tools/loadtest.py --url http://127.0.0.1:7860      # 压测已在运行的服务
+    python tools/loadtest.py --target api                     # 压测JSON接口
+
+--target 选择被测路径，每个请求上传一张图片：
+    gradio（默认）用gradio_client调用网页端的分析按钮（/analyze_stream），经过Gradio的上传、队列与流式输出，
+                  延迟为拿到最终报告的时间，与用户在网页上看到的一致；
+    api           直接调用JSON接口 /api/analyze，绕过Gradio队列，只反映模型、缓存与共用并发上限，
+                  结果不能代表网页端的延迟。
+图片为testdatas中的图片（每次随机裁掉几个像素，避免命中结果缓存）与合成头像交替，
+--repeat-ratio 控制重复上传之前图片（命中缓存）的比例。
+图片内容、请求顺序和到达时间都只由 --seed 决定；自动启动的服务不使用磁盘缓存，
+同一版本重复运行的结果可以直接比较。
+开环模式下延迟从计划到达时刻算起，包含客户端排队，服务变慢时不会因此少发请求。
+报告吞吐量、P50/P95/P99延迟、错误率和服务进程的峰值内存。
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+from gradio_client import Client, handle_file
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+def synthetic_avatar(rng, size):
+    """渐变背景上随机画几块色块，编码为JPEG（手机上传最常见的格式）"""
+    top, bottom = rng.integers(0, 256, 3), rng.integers(0, 256, 3)
+    ramp = np.linspace(0, 1, size)[:, None, None]
+    background = top * (1 - ramp) + bottom * ramp
+    img = Image.fromarray(np.broadcast_to(background, (size, size, 3)).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.integers(2, 7)):
+        x0, y0 = rng.integers(0, size, 2)
+        x1, y1 = x0 + rng.integers(size // 8, size // 2), y0 + rng.integers(size // 8, size // 2)
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape([int(x0), int(y0), int(x1), int(y1)], fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+    return _encode(img, "JPEG")
+
+
+def perturbed(image, rng):
+    """随机裁掉四边各0-8像素后重新编码：内容几乎不变，但像素不同，不会命中结果缓存"""
+    width, height = image.size
+    left, top, right, bottom = rng.integers(0, 9, 4)
+    return _encode(image.crop((int(left), int(top), width - int(right), height - int(bottom))), "PNG")
+
+
+def _encode(img, fmt):
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=90)
+    return buffer.getvalue()
+
+
+def build_workload(count, seed, repeat_ratio, size, sources):
+    """按种子生成请求序列：每项为 (文件名, 图片字节)"""
+    rng = np.random.default_rng(seed)
+    images = [Image.open(path).convert("RGB") for path in sources]
+    workload = []
+    for i in range(count):
+        if workload and rng.random() < repeat_ratio:
+            workload.append(workload[int(rng.integers(len(workload)))])
+        elif images and i % 2 == 0:
+            workload.append((f"test_{i}.png", perturbed(images[(i // 2) % len(images)], rng)))
+        else:
+            workload.append((f"synthetic_{i}.jpg", synthetic_avatar(rng, size)))
+    return workload
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, overrides, log_file, timeout=300):
+    """启动被测服务，等到 /metrics 可访问（模型已加载并预热）再返回进程"""
+    env = dict(os.environ)
+    env.pop("NINEHALLS_CACHE_DIR", None)  # 磁盘缓存会让结果依赖之前的运行
+    env.update(GRADIO_SERVER_NAME="127.0.0.1", GRADIO_SERVER_PORT=str(port), **overrides)
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py")], cwd=ROOT, env=env,
+                            stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务启动失败，见日志 {log_file.name}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=2).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError(f"服务{timeout}秒内未就绪，见日志 {log_file.name}")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+class RssSampler(threading.Thread):
+    """定期读取 /metrics 中服务自报的常驻内存，记录最大值"""
+
+    def __init__(self, url, interval=0.5):
+        super().__init__(daemon=True)
+        self.url = url
+        self.interval = interval
+        self.peak_mb = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                for line in httpx.get(f"{self.url}/metrics", timeout=2).text.splitlines():
+                    if line.startswith("ninehalls_rss_mb "):
+                        value = float(line.split()[1])
+                        self.peak_mb = value if self.peak_mb is None else max(self.peak_mb, value)
+            except (httpx.HTTPError, ValueError):
+                pass
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def peak_rss_mb(pid):
+    """进程的峰值常驻内存（Linux的VmHWM），其它平台返回None"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class ApiTarget:
+    """通过JSON接口 /api/analyze 上传"""
+
+    def __init__(self, url, concurrency, timeout):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.url = url
+        self.client = httpx.Client(timeout=timeout, limits=limits)
+
+    def send(self, name, data):
+        """上传一张图片，成功返回None，否则返回错误描述"""
+        try:
+            response = self.client.post(f"{self.url}/api/analyze", files={"files": (name, data)})
+        except httpx.HTTPError as e:
+            return type(e).__name__
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}"
+        errors = [r["error"] for r in response.json()["results"] if "error" in r]
+        return errors[0] if errors else None
+
+    def close(self):
+        self.client.close()
+
+
+class GradioTarget:
+    """通过gradio_client调用网页端的分析按钮，与浏览器一样先上传文件再排队执行"""
+
+    API_NAME = "/analyze_stream"
+
+    def __init__(self, url, concurrency, timeout):
+        # 不下载叠加图，客户端开销不计入延迟；
+        # 客户端的线程池还要常驻心跳与接收结果的SSE两个连接，线程数不够时请求永远等不到结果
+        self.client = Client(url, verbose=False, download_files=False, max_workers=concurrency + 2,
+                             httpx_kwargs={"timeout": timeout}, analytics_enabled=False)
+        self._dir = tempfile.TemporaryDirectory(prefix="loadtest_")
+
+    def send(self, name, data):
+        """上传一张图片并等到最终报告，成功返回None，否则返回错误描述"""
+        # gradio_client只能按路径上传，每个请求写一个单独的文件
+        path = os.path.join(self._dir.name, f"{threading.get_ident()}_{name}")
+        with open(path, "wb") as f:
+            f.write(data)
+        try:
+            self.client.predict(handle_file(path), api_name=self.API_NAME)
+        except Exception as e:
+            return type(e).__name__
+        finally:
+            os.remove(path)
+        return None
+
+    def close(self):
+        self.client.close()
+        self._dir.cleanup()
+
+
+TARGETS = {"gradio": GradioTarget, "api": ApiTarget}
+
+
+def run_load(target, workload, concurrency, rate, seed):
+    """
+    发送全部请求
+    :param rate: 平均每秒到达的请求数（泊松到达，开环）；0为闭环，concurrency个连接连续发送
+    :return: [(延迟秒, 完成时刻, 错误或None)], 开始时刻
+    """
+    rng = np.random.default_rng(seed + 1)  # 与图片生成分开的随机流，改变--rate不影响图片内容
+    arrivals = np.cumsum(rng.exponential(1 / rate, len(workload))) if rate > 0 else None
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        def task(name, data, scheduled):
+            start = time.perf_counter() if scheduled is None else scheduled
+            error = target.send(name, data)
+            end = time.perf_counter()
+            return end - start, end, error
+
+        begin = time.perf_counter()
+        futures = []
+        for i, (name, data) in enumerate(workload):
+            scheduled = None
+            if arrivals is not None:
+                scheduled = begin + arrivals[i]
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+            futures.append(pool.submit(task, name, data, scheduled))
+        return [future.result() for future in futures], begin
+
+
+def summarize(samples, begin):
+    latencies = np.array([latency for latency, _, _ in samples]) * 1000
+    errors = Counter(error for _, _, error in samples if error is not None)
+    duration = max(end for _, end, _ in samples) - begin
+    ok = len(samples) - sum(errors.values())
+    return {
+        "requests": len(samples),
+        "errors": sum(errors.values()),
+        "error_rate": round(sum(errors.values()) / len(samples), 4),
+        "duration_s": round(duration, 2),
+        "throughput_rps": round(ok / duration, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "max_ms": round(float(latencies.max()), 1),
+        "top_errors": errors.most_common(3),
+    }
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline, target):
+    print(f"\n对比 {baseline.get('version')}：")
+    if baseline.get("config", {}).get("target", "api") != target:
+        print(f"  注意：基线的被测路径为{baseline['config'].get('target', 'api')}，本次为{target}，结果不可直接比较")
+    for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "error_rate", "peak_rss_mb"):
+        before, after = baseline["results"].get(key), results.get(key)
+        if before is None or after is None:
+            continue
+        change = f"（{(after / before - 1) * 100:+.0f}%）" if before else ""
+        print(f"  {key:<16} {before:>10} → {after:<10}{change}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地压测：并发上传头像，统计吞吐量、延迟分位数、错误率与峰值内存")
+    parser.add_argument("--target", default="gradio", choices=list(TARGETS),
+                        help="gradio为网页端（经过Gradio队列），api为JSON接口（绕过Gradio队列）")
+    parser.add_argument("--requests", type=int, default=200, help="计入统计的请求数")
+    parser.add_argument("--warmup", type=int, default=5, help="正式开始前逐个发送、不计入统计的请求数")
+    parser.add_argument("--concurrency", type=int, default=8, help="客户端最大并发连接数")
+    parser.add_argument("--rate", type=float, default=0, help="平均每秒到达的请求数（泊松到达），0为闭环")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="重复上传之前图片的比例（命中缓存）")
+    parser.add_argument("--size", type=int, default=768, help="合成头像边长")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（图片内容、顺序与到达时间）")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求的超时秒数")
+    parser.add_argument("--url", help="压测已在运行的服务，不再自动启动")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="自动启动服务时的环境变量")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    parser.add_argument("--compare", help="与之前 --json 保存的结果对比")
+    args = parser.parse_args(argv)
+
+    sources = sorted(os.path.join(ROOT, "testdatas", name) for name in os.listdir(os.path.join(ROOT, "testdatas"))
+                     if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    workload = build_workload(args.warmup + args.requests, args.seed, args.repeat_ratio, args.size, sources)
+    overrides = dict(item.split("=", 1) for item in args.env)
+
+    proc = target = None
+    log_file = tempfile.NamedTemporaryFile("w", prefix="loadtest_server_", suffix=".log", delete=False)
+    url = args.url.rstrip("/") if args.url else None
+    try:
+        if url is None:
+            port = free_port()
+            print(f"启动服务（端口{port}，日志 {log_file.name}）……")
+            proc = start_server(port, overrides, log_file)
+            url = f"http://127.0.0.1:{port}"
+
+        target = TARGETS[args.target](url, args.concurrency, args.timeout)
+        for name, data in workload[:args.warmup]:
+            target.send(name, data)
+
+        sampler = RssSampler(url)
+        sampler.start()
+        samples, begin = run_load(target, workload[args.warmup:], args.concurrency, args.rate, args.seed)
+        sampler.stop()
+
+        results = summarize(samples, begin)
+        results["peak_rss_mb"] = round(peak_rss_mb(proc.pid) or sampler.peak_mb or 0, 1) if proc else (
+            round(sampler.peak_mb, 1) if sampler.peak_mb is not None else None)
+    finally:
+        if target is not None:
+            target.close()
+        if proc is not None:
+            stop_server(proc)
+        log_file.close()
+
+    mode = f"开环 {args.rate}/s" if args.rate > 0 else "闭环"
+    path = "网页端（Gradio队列）" if args.target == "gradio" else "JSON接口（绕过Gradio队列）"
+    print(f"{path}：{results['requests']}个请求，并发{args.concurrency}，{mode}，耗时{results['duration_s']}s")
+    print(f"吞吐量 {results['throughput_rps']} 请求/秒  错误率 {results['error_rate']:.2%}  "
+          f"峰值内存 {results['peak_rss_mb']}MB")
+    print(f"延迟 P50 {results['p50_ms']}ms  P95 {results['p95_ms']}ms  P99 {results['p99_ms']}ms  "
+          f"最大 {results['max_ms']}ms")
+    for error, count in results["top_errors"]:
+        print(f"  [错误×{count}] {error}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(results, json.load(f), args.target)
+    if args.json:
+        config = {key: getattr(args, key) for key in
+                  ("target", "requests", "warmup", "concurrency", "rate", "repeat_ratio", "size", "seed")}
+        config["env"] = overrides
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"version": git_version(), "config": config, "results": results},
+                      f, ensure_ascii=False, indent=2)
+    return 1 if results["error_rate"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
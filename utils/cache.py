@@ -0,0 +1,370 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows：不加文件锁，只适合单进程
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 感知哈希边长：每个方向 8×8 = 64 位
+HASH_SIZE = 8
+
+
+def image_key(image_array, fingerprint=""):
+    """
+    按解码后的像素内容生成缓存键
+    :param image_array: 图片array
+    :param fingerprint: 配置与模型版本指纹，配置变化后旧结果自动失效
+    """
+    h = hashlib.sha256()
+    h.update(f"{image_array.shape}|{image_array.dtype}|{fingerprint}".encode())
+    h.update(np.ascontiguousarray(image_array))
+    return h.hexdigest()
+
+
+def file_key(path, fingerprint="", chunk_size=1024 * 1024):
+    """
+    按文件内容生成缓存键（动图、短视频），分块读取，内存占用与文件大小无关
+    :param fingerprint: 同image_key
+    """
+    h = hashlib.sha256(f"file|{fingerprint}".encode())
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    分析结果缓存
+    内存层为有界LRU；指定disk_dir时另有磁盘层，按总大小淘汰最久未用的文件。
+    磁盘层总大小在进程内累加，超出容量时才扫描目录，一次删到容量的EVICT_TO比例，之后较长时间不必再扫描。
+    """
+
+    EVICT_TO = 0.9
+
+    def __init__(self, max_items=128, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk_bytes = 0  # 上次扫描得到的磁盘层总大小加上之后本进程写入的字节数
+        self._evicting = False
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = evict_oldest(disk_dir, disk_max_bytes, '.pkl', self._evict_target())
+
+    def get(self, key, record=True):
+        """
+        命中返回缓存值，否则返回None
+        :param record: 是否计入命中率；一次查询要依次尝试多个键时传False，最后用record()只计一次
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += record
+                return self._memory[key]
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += record
+                return None
+            self.hits += record
+            self.disk_hits += 1
+            self._memory_put(key, value)
+        return value
+
+    def record(self, hit):
+        """计入一次查询的命中/未命中（配合get(record=False)使用）"""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key, value):
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "memory_items": len(self._memory),
+            }
+
+    def _memory_put(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)  # 刷新访问时间，供LRU淘汰
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning("缓存文件损坏，已忽略：%s（%s）", path, e)
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.replace(tmp_path, path)  # 原子替换，多进程并发写入也不会读到半个文件
+        except OSError as e:
+            logger.warning("写入磁盘缓存失败：%s", e)
+            return
+        self._disk_evict(size)
+
+    def _evict_target(self):
+        return int(self.disk_max_bytes * self.EVICT_TO)
+
+    def _disk_evict(self, added):
+        """
+        累计写入的字节数，估计超出容量时才扫描目录、按修改时间从旧到新删除
+        其它进程的写入在扫描时一并计入，同一时刻只有一个线程扫描
+        """
+        with self._lock:
+            self._disk_bytes += added
+            if self._disk_bytes <= self.disk_max_bytes or self._evicting:
+                return
+            self._evicting = True
+        total = None
+        try:
+            total = evict_oldest(self.disk_dir, self.disk_max_bytes, '.pkl', self._evict_target())
+        except OSError as e:
+            logger.warning("清理磁盘缓存失败：%s", e)
+        finally:
+            with self._lock:
+                if total is not None:
+                    self._disk_bytes = total
+                self._evicting = False
+
+
+def evict_oldest(directory, max_bytes, suffix='', target=None):
+    """
+    目录中以suffix结尾的文件总大小超出max_bytes时，按修改时间从旧到新删除，直到不超过target
+    :param target: 删除后的目标总大小，默认为max_bytes
+    :return: 删除后的总大小
+    """
+    target = max_bytes if target is None else target
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix) and not entry.name.endswith('.tmp'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # 已被其它进程删除
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return total
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # 已被其它进程删除
+            pass
+        total -= size
+    return total
+
+
+def perceptual_hash(image_array, hash_size=HASH_SIZE):
+    """
+    双向dHash：灰度图按面积平均缩到 (hash_size+1)² 后，分别比较水平、竖直相邻像素的亮度
+    缩放、重新压缩、去除元数据后基本不变
+    :return: (2,) uint64，依次为水平与竖直方向的64位哈希
+    """
+    gray = Image.fromarray(np.ascontiguousarray(image_array[..., :3])).convert('L')
+    small = np.asarray(gray.resize((hash_size + 1, hash_size + 1), Image.BOX), dtype=np.int16)
+    horizontal = small[:hash_size, 1:] > small[:hash_size, :-1]
+    vertical = small[1:, :hash_size] > small[:-1, :hash_size]
+    bits = np.packbits(np.stack([horizontal, vertical]).reshape(2, -1), axis=1)
+    return bits.view('>u8').astype(np.uint64).ravel()
+
+
+def color_signature(image_array, grid_size=3):
+    """
+    九宫各宫的平均色（按面积平均缩到grid_size×grid_size）
+    dHash只看明暗变化，调色、滤镜后的图片哈希几乎不变，需要另外比较颜色
+    :return: (grid_size², 3) uint8
+    """
+    small = Image.fromarray(np.ascontiguousarray(image_array[..., :3])).resize((grid_size, grid_size), Image.BOX)
+    return np.asarray(small, dtype=np.uint8).reshape(-1, 3)
+
+
+class NearDuplicateIndex:
+    """
+    感知哈希近重复索引：感知哈希 -> 结果缓存键
+    保存在内存映射文件中（定长环形缓冲，写满后覆盖最旧的记录），多个工作进程共用同一份索引，重启后仍然有效。
+    查询时对全部记录做一次异或+popcount，汉明距离不超过阈值、宽高比与九宫平均色相近且模型指纹相同才算命中。
+    """
+
+    _HEADER = 64  # 魔数(8) + 容量(8) + 已写入总数(8)，其余保留
+    _MAGIC = b"NHPHASH1"
+    # 哈希单独连续存放，查询时顺序扫描；其余字段只在候选记录上读取
+    _HASH = np.dtype(('<u8', (2,)))
+    _RECORD = np.dtype([('aspect', '<f4'), ('colors', 'u1', (9, 3)), ('tag', '<u8'), ('key', 'u1', (32,))])
+
+    def __init__(self, path, capacity=65536, max_distance=6, aspect_tolerance=0.02, color_tolerance=8):
+        """
+        :param path: 索引文件路径（不存在时创建；已存在时沿用文件中的容量）
+        :param capacity: 最多保存的记录数
+        :param max_distance: 汉明距离阈值（共128位），越大越容易把不同头像当作同一张
+        :param aspect_tolerance: 宽高比允许的相对误差（裁剪过的图片不算同一张）
+        :param color_tolerance: 各宫平均色每个通道允许的差值（0-255，调过色的图片不算同一张）
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.aspect_tolerance = aspect_tolerance
+        self.color_tolerance = color_tolerance
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()  # 本进程内的线程互斥，同时保护命中计数
+
+        # 'a+b'的写入总是追加到末尾，这里要改写文件头，所以用O_CREAT打开后按读写模式使用
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+        with self._locked(exclusive=True):
+            self._file.seek(0, os.SEEK_END)
+            if self._file.tell() < self._HEADER:
+                self._file.truncate(self._HEADER + capacity * (self._HASH.itemsize + self._RECORD.itemsize))
+                self._file.seek(0)
+                self._file.write(self._MAGIC + np.array([capacity, 0], dtype='<u8').tobytes())
+                self._file.flush()
+            self._file.seek(0)
+            magic = self._file.read(len(self._MAGIC))
+            if magic != self._MAGIC:
+                raise ValueError(f"不是近重复索引文件：{path}")
+
+        self._header = np.memmap(path, dtype='<u8', mode='r+', offset=len(self._MAGIC), shape=(2,))
+        self.capacity = int(self._header[0])
+        self._hashes = np.memmap(path, dtype='<u8', mode='r+', offset=self._HEADER, shape=(self.capacity, 2))
+        self._records = np.memmap(path, dtype=self._RECORD, mode='r+',
+                                  offset=self._HEADER + self.capacity * self._HASH.itemsize, shape=(self.capacity,))
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """
+        跨进程文件锁：写入独占、查询共享，避免读到写了一半的记录
+        flock加在同一个文件描述符上，对本进程的其它线程不起作用，所以同时持有线程锁
+        """
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _tag(fingerprint):
+        return int(hashlib.sha256(fingerprint.encode()).hexdigest()[:16], 16)
+
+    @staticmethod
+    def signature(image_array):
+        """图片的 (感知哈希, 宽高比, 九宫平均色)，作为lookup/add的参数"""
+        height, width = image_array.shape[:2]
+        return perceptual_hash(image_array), width / height, color_signature(image_array)
+
+    def lookup(self, signature, fingerprint=""):
+        """
+        查找近重复图片
+        :param signature: signature()的返回值
+        :param fingerprint: 配置与模型版本指纹，不同指纹的记录互不命中
+        :return: (结果缓存键, 汉明距离)，没有时返回None
+        """
+        phash, aspect, colors = signature
+        with self._locked():
+            count = min(int(self._header[1]), self.capacity)
+            # 先只比较哈希，少数候选再核对宽高比、颜色与指纹
+            distance = np.bitwise_count(self._hashes[:count] ^ phash).sum(axis=1)
+            candidates = np.flatnonzero(distance <= self.max_distance)
+            records = self._records[candidates]
+        if len(candidates):
+            valid = ((records['tag'] == self._tag(fingerprint))
+                     & (np.abs(records['aspect'] - aspect) <= self.aspect_tolerance * aspect)
+                     & (np.abs(records['colors'].astype(np.int16) - colors).max(axis=(1, 2))
+                        <= self.color_tolerance))
+            if valid.any():
+                order = np.flatnonzero(valid)
+                best = order[np.argmin(distance[candidates[order]])]
+                with self._lock:
+                    self.hits += 1
+                return records['key'][best].tobytes().hex(), int(distance[candidates[best]])
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def add(self, signature, key, fingerprint=""):
+        """
+        记录一张已分析的图片
+        :param signature: signature()的返回值
+        :param key: 结果缓存键（image_key返回的十六进制串）
+        """
+        phash, aspect, colors = signature
+        with self._locked(exclusive=True):
+            total = int(self._header[1])
+            slot = total % self.capacity
+            self._hashes[slot] = phash
+            self._records[slot] = (aspect, colors, self._tag(fingerprint),
+                                   np.frombuffer(bytes.fromhex(key), np.uint8))
+            self._header[1] = total + 1
+            for mapped in (self._hashes, self._records, self._header):
+                mapped.flush()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "records": min(int(self._header[1]), self.capacity),
+        }
+
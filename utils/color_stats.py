@@ -0,0 +1,112 @@
+import numpy as np
+
+from utils.utils import ELEMENTS, classify_elements
+
+
+def grid_edges(length, grid_size=3):
+    """九宫格切分边界，与LuoshuAnalyzer.analyze_image的裁剪方式一致"""
+    return np.array([length * i // grid_size for i in range(grid_size + 1)])
+
+
+def grid_labels(height, width, grid_size=3, sample_step=1):
+    """
+    采样像素所属宫位编号（行优先，0 ~ grid_size²-1）
+    :return: (采样行数, 采样列数) 的int32数组
+    """
+    rows = np.arange(0, height, sample_step)
+    cols = np.arange(0, width, sample_step)
+    row_idx = np.searchsorted(grid_edges(height, grid_size)[1:-1], rows, side='right')
+    col_idx = np.searchsorted(grid_edges(width, grid_size)[1:-1], cols, side='right')
+    return (row_idx[:, None] * grid_size + col_idx[None, :]).astype(np.int32)
+
+
+def grid_color_stats(img_array, grid_size=3, bins=8, top_k=0, sample_step=1, with_elements=False):
+    """
+    一次遍历统计各宫颜色
+    :param img_array: 整张图片array（RGB）
+    :param grid_size: 宫格边长（默认3×3）
+    :param bins: 每个通道的量化级数（2的幂），用于求众数色和调色板
+    :param top_k: 调色板颜色数，0表示不计算
+    :param sample_step: 采样步长，1为逐像素统计，n为每隔n行n列取一个像素
+    :param with_elements: 是否同时统计逐像素五行直方图
+    :return: 每宫一个 {"mean": 平均色, "mode": 众数色, "palette": [(颜色, 占比), ...]}，
+             with_elements时另有 "elements": {五行: 像素占比}
+    """
+    shift = 8 - int(np.log2(bins))
+    height, width = img_array.shape[:2]
+    pixels = img_array[::sample_step, ::sample_step, :3]
+    labels = grid_labels(height, width, grid_size, sample_step).ravel()
+
+    n_grids = grid_size * grid_size
+    n_bins = bins ** 3
+    channels = [pixels[..., c].ravel() for c in range(3)]
+
+    # 平均色：每个通道按宫位分组求和
+    counts = np.bincount(labels, minlength=n_grids)
+    sums = np.stack([np.bincount(labels, weights=ch, minlength=n_grids) for ch in channels], axis=1)
+    means = sums / np.maximum(counts, 1)[:, None]
+
+    # 量化直方图：(宫位, 颜色桶) 联合计数，桶内再求平均色作为代表色
+    quantized = ((channels[0] >> shift).astype(np.int32) * bins
+                 + (channels[1] >> shift)) * bins + (channels[2] >> shift)
+    joint = labels * n_bins + quantized
+    hist = np.bincount(joint, minlength=n_grids * n_bins).reshape(n_grids, n_bins)
+    bin_sums = np.stack([np.bincount(joint, weights=ch, minlength=n_grids * n_bins)
+                         for ch in channels], axis=1).reshape(n_grids, n_bins, 3)
+    bin_colors = bin_sums / np.maximum(hist, 1)[..., None]
+
+    # 五行直方图：整图只做一次HSV换算
+    if with_elements:
+        element_idx = classify_elements(pixels).ravel()
+        element_hist = np.bincount(labels * len(ELEMENTS) + element_idx,
+                                   minlength=n_grids * len(ELEMENTS)).reshape(n_grids, len(ELEMENTS))
+        element_ratio = element_hist / np.maximum(counts, 1)[:, None]
+
+    mode_bins = hist.argmax(axis=1)
+    if top_k:
+        palette_bins = np.argsort(-hist, axis=1, kind='stable')[:, :top_k]
+
+    stats = []
+    for idx in range(n_grids):
+        item = {
+            "mean": _to_rgb(means[idx]),
+            "mode": _to_rgb(bin_colors[idx, mode_bins[idx]]),
+            "palette": [],
+        }
+        if top_k:
+            item["palette"] = [
+                (_to_rgb(bin_colors[idx, b]), round(float(hist[idx, b] / max(counts[idx], 1)), 3))
+                for b in palette_bins[idx] if hist[idx, b] > 0
+            ]
+        if with_elements:
+            item["elements"] = {e: round(float(element_ratio[idx, k]), 4) for k, e in enumerate(ELEMENTS)}
+        stats.append(item)
+    return stats
+
+
+def color_stats(img_array, bins=8, top_k=0, sample_step=1, with_elements=False):
+    """单个区域的颜色统计（等价于grid_size=1）"""
+    return grid_color_stats(img_array, 1, bins, top_k, sample_step, with_elements)[0]
+
+
+def texture_stats(img_array, max_side=64):
+    """
+    区域的纹理/颜色均匀度（只在缩小的采样网格上计算，开销远小于一次推理）
+    :param max_side: 采样后长边的最大像素数
+    :return: {"edge": 灰度平均梯度（0-255）, "std": RGB各通道标准差的最大值}
+    """
+    height, width = img_array.shape[:2]
+    step = max(1, -(-max(height, width) // max_side))
+    sample = img_array[::step, ::step, :3]
+    gray = sample.sum(axis=2, dtype=np.int16)  # 三通道之和，0-765
+    edge_y = np.abs(np.diff(gray, axis=0)).mean() if gray.shape[0] > 1 else 0.0
+    edge_x = np.abs(np.diff(gray, axis=1)).mean() if gray.shape[1] > 1 else 0.0
+    channels = sample.reshape(-1, 3).T.astype(np.float32)  # 按通道连续存放，求标准差更快
+    return {
+        "edge": float(edge_x + edge_y) / 6,
+        "std": float(channels.std(axis=1).max()),
+    }
+
+
+def _to_rgb(color):
+    return tuple(int(c) for c in color)
@@ -0,0 +1,39 @@
+"""
+配置文件加载
+
+相对路径一律按项目根目录解析，与启动时的工作目录无关；
+同一文件只读取一次，之后各模块共用缓存的内容（调用方不要修改返回的对象）。
+"""
+import json
+import os
+from functools import lru_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def resolve_path(path):
+    """相对路径转为项目根目录下的绝对路径"""
+    path = os.fspath(path)
+    return path if os.path.isabs(path) else os.path.join(ROOT, path)
+
+
+@lru_cache(maxsize=None)
+def _load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def _load_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def load_json(path):
+    """读取并缓存JSON配置，如 load_json('data/wuxing.json')"""
+    return _load_json(resolve_path(path))
+
+
+def load_text(path):
+    """读取并缓存文本文件（报告模板等）"""
+    return _load_text(resolve_path(path))
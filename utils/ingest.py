@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+from PIL import Image, ImageOps, ImageSequence
+
+# 各阶段的工作分辨率上限（长边像素）
+DISPLAY_MAX_SIDE = 1024  # 叠加图展示
+DETECT_MAX_SIDE = 640    # YOLO本身会letterbox到640，更大没有意义
+COLOR_MAX_SIDE = 512     # 颜色与五行直方图统计
+
+# 按短视频处理的扩展名（OpenCV解码）；GIF/APNG/动态WebP由PIL逐帧解码
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.webm', '.mkv', '.avi')
+
+
+def load_image(source, max_side=DISPLAY_MAX_SIDE):
+    """
+    解码图片并把长边限制在max_side以内
+    JPEG用draft模式在解码阶段直接按1/2、1/4、1/8缩小，内存和耗时不再随相机像素增长
+    :param source: 文件路径、文件对象、PIL图片或numpy数组
+    :return: RGB的uint8数组
+    """
+    if isinstance(source, np.ndarray):
+        return downscale(source, max_side)
+    if isinstance(source, Image.Image):
+        return _fit(source, max_side)
+    with Image.open(source) as img:
+        return _fit(img, max_side)
+
+
+def _fit(img, max_side):
+    if img.format == 'JPEG':
+        img.draft('RGB', (max_side, max_side))
+    img = ImageOps.exif_transpose(img)  # 手机照片按EXIF方向摆正
+    img = img.convert('RGB')
+    img.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(img)
+
+
+def downscale(image_array, max_side):
+    """长边超过max_side时按比例缩小，否则原样返回（不复制）"""
+    height, width = image_array.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image_array
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return np.asarray(Image.fromarray(image_array).resize(size, Image.BILINEAR, reducing_gap=2.0))
+
+
+def is_animated(source):
+    """是否为动图（多帧GIF/APNG/WebP）或短视频"""
+    if isinstance(source, Image.Image):
+        return getattr(source, 'is_animated', False)
+    if not isinstance(source, (str, os.PathLike)):
+        return False
+    if os.fspath(source).lower().endswith(VIDEO_EXTENSIONS):
+        return True
+    try:
+        with Image.open(source) as img:
+            return getattr(img, 'is_animated', False)
+    except OSError:
+        return False
+
+
+def iter_frames(source, sample_fps=2.0, max_frames=60, max_side=DISPLAY_MAX_SIDE):
+    """
+    逐帧解码动图或短视频，按时间均匀采样
+    生成器一次只解码、保留一帧，内存占用与片长无关
+    :param source: 文件路径或PIL图片
+    :param sample_fps: 每秒采样的帧数
+    :param max_frames: 最多产出的帧数
+    :param max_side: 每帧长边上限
+    :return: 逐个产出 (时间秒, RGB的uint8数组)
+    """
+    if not isinstance(source, Image.Image) and os.fspath(source).lower().endswith(VIDEO_EXTENSIONS):
+        frames = _iter_video(source)
+    else:
+        frames = _iter_image_frames(source)
+
+    # 按时间均匀采样：每个采样时刻取当时正在显示的帧，长时间停留的帧会被重复产出（不重复解码）
+    count = 0  # 第count个采样时刻为 count / sample_fps
+    for timestamp, duration, decode in frames:
+        frame = None
+        while count / sample_fps < timestamp + duration - 1e-9 and count < max_frames:
+            if frame is None:
+                frame = decode(max_side)
+            yield round(count / sample_fps, 6), frame
+            count += 1
+        if count >= max_frames:
+            return
+
+
+def _iter_image_frames(source):
+    """PIL动图：产出 (开始时间, 时长, 解码函数)，未被采样的帧不做颜色转换和缩放"""
+    img = source if isinstance(source, Image.Image) else Image.open(source)
+    try:
+        timestamp = 0.0
+        for frame in ImageSequence.Iterator(img):
+            # 浏览器把不超过10ms的帧时长按100ms播放
+            duration = frame.info.get('duration') or 0
+            duration = (duration if duration > 10 else 100) / 1000
+            yield timestamp, duration, lambda max_side, f=frame: _fit(f, max_side)
+            timestamp += duration
+    finally:
+        if img is not source:
+            img.close()
+
+
+def _iter_video(path):
+    """OpenCV视频：产出 (开始时间, 时长, 解码函数)；grab只读取不转换，被采样的帧才retrieve并转为RGB"""
+    import cv2
+
+    capture = cv2.VideoCapture(os.fspath(path))
+    if not capture.isOpened():
+        raise OSError(f"无法打开视频：{path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+
+    def decode(max_side):
+        ok, bgr = capture.retrieve()
+        if not ok:
+            raise OSError(f"视频解码失败：{path}")
+        return downscale(np.ascontiguousarray(bgr[..., ::-1]), max_side)
+
+    try:
+        index = 0
+        while capture.grab():
+            yield index / fps, 1 / fps, decode
+            index += 1
+    finally:
+        capture.release()
@@ -0,0 +1,192 @@
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from utils.config import load_json, resolve_path
+
+# 叠加图输出格式：名称 -> (PIL保存格式, MIME类型)
+OVERLAY_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+# WebP编码速度档位（0-6）：768px叠加图上2档约35ms、4档（PIL默认）约75ms，体积只差5%
+WEBP_METHOD = 2
+
+
+@lru_cache(maxsize=32)
+def load_fonts(font_size):
+    """按字号加载并缓存字体：(中文字体, 八卦符号字体)"""
+    # 设置中文字体（建议使用支持中文的字体文件）
+    try:
+        cn_font = ImageFont.truetype(resolve_path("data/fonts/simhei.ttf"), font_size) if os.name == 'nt' else ImageFont.truetype("NotoSansCJK-Regular.ttc", font_size)
+    except OSError:
+        cn_font = ImageFont.load_default()  # 备用默认字体
+
+    # 八卦符号用Segoe UI Symbol（仅Windows）
+    symbol_font = ImageFont.truetype(resolve_path("data/fonts/seguisym.ttf"), font_size) if os.name == 'nt' else cn_font
+    return cn_font, symbol_font
+
+
+class NineHallsOverlay:
+    """
+    九宫格叠加层渲染器
+    虚线、圆角底框、八卦符号、宫名和角落提示都是静态内容，
+    每种输出尺寸只渲染一次透明图层，之后每次请求只需叠加到原图上。
+    """
+
+    def __init__(self, config_path='data/jiugong.json', grids=None, cache_size=16):
+        if grids is None:
+            # 加载八卦配置
+            grids = load_json(config_path)['grids']
+        self.grids = grids
+        self.cache_size = cache_size
+        self._layers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, img, copy=True):
+        """
+        在图片上叠加九宫格
+        :param copy: 为False时直接画在传入的RGB图片上（调用方自己持有的临时图片可省一次复制）
+        """
+        layer = self.layer(*img.size)
+        grid_img = img.convert('RGB') if copy or img.mode != 'RGB' else img  # convert同时完成复制
+        grid_img.paste(layer, (0, 0), layer)
+        return grid_img
+
+    def layer(self, width, height):
+        """获取（必要时渲染）指定尺寸的RGBA叠加层"""
+        key = (width, height)
+        with self._lock:
+            if key in self._layers:
+                self._layers.move_to_end(key)
+                return self._layers[key]
+
+        layer = self._draw_layer(width, height)
+        with self._lock:
+            self._layers[key] = layer
+            while len(self._layers) > self.cache_size:
+                self._layers.popitem(last=False)
+        return layer
+
+    def _draw_layer(self, width, height):
+        layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        self._draw_dashes(layer)
+
+        draw = ImageDraw.Draw(layer)
+        font_size = min(width, height) // 25
+        cn_font, symbol_font = load_fonts(font_size)
+
+        # 为每个格子添加标记
+        for i in range(3):
+            for j in range(3):
+                config = self.grids[i * 3 + j]
+
+                # 计算当前格子中心坐标
+                x_center = width * (j + 0.5) / 3
+                y_center = height * (i + 0.5) / 3
+
+                # 绘制半透明背景圆角矩形
+                bg_width = width // 4
+                bg_height = height // 8
+                draw.rounded_rectangle(
+                    [(x_center - bg_width // 2, y_center - bg_height // 2),
+                     (x_center + bg_width // 2, y_center + bg_height // 2)],
+                    radius=10, fill=(0, 0, 0, 50)  # 半透明黑色背景
+                )
+
+                # 第一行：分开渲染八卦符号（默认字体）和宫位名（黑体）
+                symbol_width = draw.textlength(config['symbol'], font=symbol_font)
+                total_width = symbol_width + draw.textlength(config['name'], font=cn_font)
+
+                # 先绘制八卦符号
+                draw.text(
+                    (x_center - total_width / 2, y_center - bg_height / 4),
+                    config['symbol'],
+                    font=symbol_font,
+                    fill="white",
+                    anchor="lt"
+                )
+                # 再绘制中文宫位名
+                draw.text(
+                    (x_center - total_width / 2 + symbol_width, y_center - bg_height / 4),
+                    config['name'],
+                    font=cn_font,
+                    fill="white",
+                    anchor="lt"
+                )
+
+                # 第二行：方位 + 五行（如：北方·水）
+                sub_text = f"{config['position']}方·{config['element']}"
+                draw.text((x_center, y_center + bg_height // 5),
+                          sub_text, font=cn_font, fill="#AAAAAA", anchor="mm")
+
+                # 在格子角落添加小字提示（如：财运）
+                corner_x = width * (j + 0.2) / 3
+                corner_y = height * (i + 0.2) / 3
+                draw.text((corner_x, corner_y), config["meaning"],
+                          font=cn_font, fill="#FFCC00", anchor="lt")
+        return layer
+
+    @staticmethod
+    def _draw_dashes(layer, dash_pattern=(8, 4), line_width=2):
+        """绘制九宫格线（红色虚线效果），整条线一次写入像素"""
+        width, height = layer.size
+        pixels = np.zeros((height, width, 4), dtype=np.uint8)
+        dash, gap = dash_pattern  # 实线8px，空白4px
+        half = line_width // 2
+
+        on_y = (np.arange(height) % (dash + gap)) <= dash
+        on_x = (np.arange(width) % (dash + gap)) <= dash
+        for i in range(1, 3):
+            # 竖线（虚线）
+            x = width * i // 3
+            pixels[on_y, max(x - half, 0):x - half + line_width] = (255, 0, 0, 255)
+            # 横线（虚线）
+            y = height * i // 3
+            pixels[max(y - half, 0):y - half + line_width, on_x] = (255, 0, 0, 255)
+        layer.paste(Image.fromarray(pixels, 'RGBA'))
+
+
+_default_overlay = None
+
+
+def draw_ninehalls(img, copy=True):
+    """在图片上绘制后天八卦九宫格（共用进程内的渲染缓存）"""
+    global _default_overlay
+    if _default_overlay is None:
+        _default_overlay = NineHallsOverlay()
+    return _default_overlay.render(img, copy)
+
+
+def encode_overlay(img, max_side=768, fmt="webp", quality=80):
+    """
+    叠加图缩小到展示尺寸后编码为有损格式，只编码一次，编码结果随分析结果一起缓存
+    :param img: draw_ninehalls返回的PIL图片
+    :param max_side: 长边上限（界面上只在小面板中展示，不需要上传时的分辨率）
+    :param fmt: webp / jpeg / png
+    :param quality: 有损格式的质量（1-100，png忽略）
+    :return: {"data": 编码后的字节, "mime": MIME类型, "size": (宽, 高), "encode_ms": 缩放与编码耗时}
+    """
+    pil_format, mime = OVERLAY_FORMATS[fmt]
+    start = time.perf_counter()
+    width, height = img.size
+    scale = max_side / max(width, height)
+    if scale < 1:
+        img = img.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                         Image.BILINEAR, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    options = {"method": WEBP_METHOD} if pil_format == "WEBP" else {}
+    img.save(buffer, format=pil_format, quality=quality, **options)
+    return {
+        "data": buffer.getvalue(),
+        "mime": mime,
+        "size": img.size,
+        "encode_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
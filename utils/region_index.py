@@ -0,0 +1,123 @@
+import numpy as np
+
+from utils.color_stats import grid_edges
+from utils.utils import ELEMENTS, classify_elements
+
+
+class RegionIndex:
+    """
+    图片的积分图（summed-area table）索引
+    对RGB三个通道和五行归属（每种五行一个0/1平面）分别做二维前缀和，每张图只建一次，
+    之后任意矩形的平均色与五行占比都只需4次查表，与区域大小无关。
+    九宫、更细的子宫格和滑动窗口搜索共用同一份索引。
+    """
+
+    def __init__(self, img_array, sample_step=1):
+        """
+        :param img_array: 整张图片array（RGB，uint8）
+        :param sample_step: 采样步长，1为逐像素；与grid_color_stats一样每隔n行n列取一个像素
+        """
+        self.height, self.width = img_array.shape[:2]
+        self.sample_step = sample_step
+        pixels = img_array[::sample_step, ::sample_step, :3]
+        rows, cols = pixels.shape[:2]
+
+        # 颜色和的上界为 255 × 像素数，大图才需要int64；五行计数不超过像素数，int32足够，两组平面分开存放
+        self.colors = self._prefix_sum(pixels, np.int32 if 255 * rows * cols < 2 ** 31 else np.int64)
+        element_idx = classify_elements(pixels)
+        self.elements = self._prefix_sum(element_idx[..., None] == np.arange(len(ELEMENTS)),
+                                         np.int32 if rows * cols < 2 ** 31 else np.int64)
+
+    @staticmethod
+    def _prefix_sum(values, dtype):
+        """(rows, cols, c) -> 首行首列补零的二维前缀和 (rows+1, cols+1, c)"""
+        rows, cols, channels = values.shape
+        table = np.zeros((rows + 1, cols + 1, channels), dtype=dtype)
+        table[1:, 1:] = values
+        np.cumsum(table, axis=0, out=table)
+        np.cumsum(table, axis=1, out=table)
+        return table
+
+    def _to_sample(self, coords):
+        """原图坐标 -> 采样网格坐标（坐标为t的采样行/列落在[t, …)中，与grid_labels的归属一致）"""
+        return -(-np.asarray(coords, dtype=np.int64) // self.sample_step)
+
+    def sums(self, boxes):
+        """
+        批量求矩形内的通道和
+        :param boxes: (N,4) 原图坐标 (top, bottom, left, right)，左闭右开
+        :return: ((N,8) 各平面之和, (N,) 采样像素数)
+        """
+        boxes = self._to_sample(np.reshape(boxes, (-1, 4)))
+        top, bottom, left, right = boxes.T
+        total = np.concatenate([
+            t[bottom, right].astype(np.int64) - t[top, right] - t[bottom, left] + t[top, left]
+            for t in (self.colors, self.elements)
+        ], axis=1)
+        return total, (bottom - top) * (right - left)
+
+    def region_stats(self, boxes):
+        """
+        批量求矩形的平均色与五行占比
+        :return: {"mean": (N,3) 平均色, "elements": (N,5) 五行像素占比（列顺序同ELEMENTS）, "count": (N,) 像素数}
+        """
+        total, count = self.sums(boxes)
+        scale = 1 / np.maximum(count, 1)[:, None]
+        return {"mean": total[:, :3] * scale, "elements": total[:, 3:] * scale, "count": count}
+
+    def grid_boxes(self, grid_size=3):
+        """grid_size×grid_size宫格的矩形（行优先），切分方式与九宫一致"""
+        edges_y = grid_edges(self.height, grid_size)
+        edges_x = grid_edges(self.width, grid_size)
+        return np.array([(edges_y[i], edges_y[i + 1], edges_x[j], edges_x[j + 1])
+                         for i in range(grid_size) for j in range(grid_size)])
+
+    def grid_stats(self, grid_size=3):
+        """
+        各宫的平均色与五行占比，格式同grid_color_stats(with_elements=True)的对应字段
+        :return: 每宫一个 {"mean": 平均色, "elements": {五行: 像素占比}}
+        """
+        stats = self.region_stats(self.grid_boxes(grid_size))
+        return [
+            {
+                "mean": tuple(int(c) for c in mean),
+                "elements": {e: round(float(ratio[k]), 4) for k, e in enumerate(ELEMENTS)},
+            }
+            for mean, ratio in zip(stats["mean"], stats["elements"])
+        ]
+
+    def element_map(self, element, window, stride=None):
+        """
+        滑动窗口下某种五行的像素占比
+        :param element: 五行名称
+        :param window: 窗口边长（原图像素）
+        :param stride: 步长（原图像素），默认为窗口边长的一半
+        :return: (占比矩阵, 窗口左上角的原图y坐标, x坐标)
+        """
+        k = ELEMENTS.index(element)
+        size = max(1, int(self._to_sample(window)))
+        step = max(1, int(self._to_sample(stride or max(1, window // 2))))
+        t = self.elements[..., k]
+        rows, cols = t.shape[0] - 1, t.shape[1] - 1
+        ys = np.arange(0, max(rows - size, 0) + 1, step)
+        xs = np.arange(0, max(cols - size, 0) + 1, step)
+        y1, x1 = np.minimum(ys + size, rows), np.minimum(xs + size, cols)
+        counts = np.outer(y1 - ys, x1 - xs)
+        total = (t[np.ix_(y1, x1)].astype(np.int64) - t[np.ix_(ys, x1)]
+                 - t[np.ix_(y1, xs)] + t[np.ix_(ys, xs)])
+        return total / np.maximum(counts, 1), ys * self.sample_step, xs * self.sample_step
+
+    def hot_spots(self, element, window, stride=None, top_k=3):
+        """
+        某种五行最集中的窗口（不去重叠）
+        :return: [(占比, (top, bottom, left, right)), ...]，按占比从高到低
+        """
+        ratios, ys, xs = self.element_map(element, window, stride)
+        order = np.argsort(-ratios, axis=None, kind='stable')[:top_k]
+        spots = []
+        for flat in order:
+            i, j = np.unravel_index(flat, ratios.shape)
+            top, left = int(ys[i]), int(xs[j])
+            spots.append((round(float(ratios[i, j]), 4),
+                          (top, min(top + window, self.height), left, min(left + window, self.width))))
+        return spots
@@ -1,15 +1,49 @@
 from datetime import datetime
-from pathlib import Path
+
+from utils.config import load_text
 
 
 class ReportFormatter:
     def __init__(self):
-        self.template = Path("data/result_template.txt").read_text(encoding="utf-8")
+        self.template = load_text("data/result_template.txt")
 
     def generate(self, wuxing, grid_wuxing):
         analysis = self._prepare_data(wuxing, grid_wuxing)
         return self.template.format(**analysis)
 
+    def generate_data(self, wuxing, grids):
+        """
+        结构化的分析结果（JSON接口用），内容与generate的报告一致，数值均为Python原生类型
+        :return: {"wuxing": 全图五行, "grids": 九宫结果, "summary": {和谐宫位数、整体建议、运势提示}}
+        """
+        return {
+            "wuxing": _plain(wuxing),
+            "grids": _plain(grids),
+            "summary": {
+                "harmony_count": sum(1 for g in grids if g['is_harmony']),
+                "overall_suggestion": self._generate_suggestion(grids),
+                "fortune_tip": self._generate_fortune_tip(wuxing, grids),
+            },
+        }
+
+    def generate_progress(self, wuxing, grids, total=9):
+        """
+        分析未完成时的阶段性报告，供界面流式展示
+        :param wuxing: 全图五行（尚未得出时为None）
+        :param grids: 已完成的宫位结果
+        """
+        if wuxing is None:
+            return "⏳ 正在识别核心五行……"
+        pending = "⏳ 分析中……"
+        return self.template.format(
+            wuxing_name=wuxing["name"],
+            wuxing_score=min(wuxing["score"], 1) * 100,
+            wuxing_reason=wuxing["reason"],
+            grid_analysis=self._format_grids(grids) + f"\n⏳ 已完成{len(grids)}/{total}宫……",
+            overall_suggestion=pending,
+            fortune_tip=pending,
+        )
+
     def _prepare_data(self, wuxing, grids):
         """处理数据为模板需要的格式"""
         return {
@@ -61,3 +95,14 @@ class ReportFormatter:
         if conflict_count > 3:
             return "多宫位能量冲突，建议佩戴五行调和饰品"
         return "整体运势平稳，注意劳逸结合"
+
+
+def _plain(value):
+    """numpy标量/数组、元组转为JSON可序列化的Python原生类型"""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if hasattr(value, 'tolist'):  # numpy标量与数组
+        return value.tolist()
+    return value
@@ -0,0 +1,191 @@
+"""
+请求级分阶段计时与本地指标
+
+NINEHALLS_TRACE=1 时启用：每个请求记录各阶段耗时、推理次数和缓存命中，
+结束时写一行结构化日志，并汇总到Prometheus格式的指标中。
+关闭时stage()/count()只做一次布尔判断，开销可以忽略。
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger("ninehalls.trace")
+
+ENABLED = os.environ.get("NINEHALLS_TRACE") == "1"
+
+# 耗时直方图分桶（秒）
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_NULL = nullcontext()
+_END = object()
+_current = contextvars.ContextVar("ninehalls_trace", default=None)
+
+
+class Metrics:
+    """进程内指标：计数器、耗时直方图，以及按需读取的仪表值"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.setdefault(key, [[0] * len(_BUCKETS), 0.0, 0])
+            for i, bound in enumerate(_BUCKETS):
+                if seconds <= bound:
+                    hist[0][i] += 1
+            hist[1] += seconds
+            hist[2] += 1
+
+    def gauge(self, name, fn):
+        """注册仪表：导出时调用fn()，返回数值或 {标签值: 数值} 字典"""
+        self._gauges[name] = fn
+
+    def render(self):
+        """Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"ninehalls_{name}_total{_labels(labels)} {value}")
+            for (name, labels), (buckets, total, count) in sorted(self._histograms.items()):
+                metric = f"ninehalls_{name}_seconds"
+                for bound, n in zip(_BUCKETS, buckets):
+                    lines.append(f"{metric}_bucket{_labels(labels + (('le', bound),))} {n}")
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{metric}_sum{_labels(labels)} {total:.6f}")
+                lines.append(f"{metric}_count{_labels(labels)} {count}")
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:  # 指标读取失败不影响导出
+                logger.warning("读取指标%s失败：%s", name, e)
+                continue
+            if isinstance(value, dict):
+                for key, v in value.items():
+                    if isinstance(v, (int, float)):
+                        lines.append(f"ninehalls_{name}{_labels((('key', key),))} {v}")
+            elif value is not None:
+                lines.append(f"ninehalls_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class Trace:
+    """单个请求的分阶段耗时与计数"""
+
+    def __init__(self, name):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.stages = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+
+    def add_stage(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def to_dict(self):
+        return {
+            "trace_id": self.id,
+            "request": self.name,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "stages_ms": {k: round(v * 1000, 2) for k, v in self.stages.items()},
+            "counters": self.counters,
+        }
+
+
+@contextmanager
+def request(name):
+    """包裹一次请求；结束时输出日志并汇总指标"""
+    if not ENABLED:
+        yield None
+        return
+
+    trace = Trace(name)
+    token = _current.set(trace)
+    status = "ok"
+    try:
+        yield trace
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:  # 生成器的各步可能在不同的上下文中执行（如Gradio流式输出）
+            _current.set(None)
+        record = trace.to_dict()
+        record["status"] = status
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+        METRICS.inc("requests", request=name, status=status)
+        METRICS.observe("request", record["total_ms"] / 1000, request=name)
+        for stage_name, seconds in trace.stages.items():
+            METRICS.observe("stage", seconds, stage=stage_name)
+        for counter, value in trace.counters.items():
+            METRICS.inc(counter, value)
+
+
+def resume(trace):
+    """
+    在当前上下文中重新绑定请求记录
+    流式生成器每次yield之后可能换到新的线程/上下文中继续执行，恢复后各阶段才能继续计入同一请求
+    """
+    if trace is not None:
+        _current.set(trace)
+
+
+def stage(name):
+    """记录一个阶段的耗时（未启用或不在请求内时为空操作）"""
+    if not ENABLED or _current.get() is None:
+        return _NULL
+    return _stage(name)
+
+
+@contextmanager
+def _stage(name):
+    trace = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - start)
+
+
+def iterate(name, iterable):
+    """逐项产出iterable的内容，只把生成每一项的耗时计入阶段name（不含调用方处理这一项的时间）"""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def count(name, value=1):
+    """请求内计数，如推理次数、缓存命中"""
+    if not ENABLED:
+        return
+    trace = _current.get()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + value
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
@@ -1,11 +1,15 @@
-import cv2
 import colorsys
 import numpy as np
 import os
 
 # 辅助函数：获取主色
 def get_dominant_color(img_array, k=1):
-    pixels = img_array.reshape(-1, 3)
+    pixels = img_array.reshape(-1, img_array.shape[-1])[:, :3]
+    if k == 1:
+        # k=1时聚类中心就是均值，无需迭代
+        return tuple(map(int, pixels.mean(axis=0)))
+    import cv2  # 只有k>1的聚类用到OpenCV，导入推迟到此处
+
     criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, 0.1)
     _, labels, palette = cv2.kmeans(pixels.astype(np.float32), k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
     return tuple(map(int, palette[0]))
@@ -46,6 +50,80 @@ def color_to_wuxing(rgb):
         return {"name": "火", "score": int(s * 70 + v * 30), "reason": "紫为火之余气"}
 
 
+# 五行顺序，与data/wuxing.json的elements一致
+ELEMENTS = ["木", "火", "土", "金", "水"]
+
+
+def classify_elements(rgb_array):
+    """
+    逐像素五行分类（color_to_wuxing规则的向量化版本）
+    :param rgb_array: (..., 3) 的RGB数组（uint8）
+    :return: 同形状（去掉通道维）的int8数组，值为ELEMENTS中的下标
+    """
+    rgb = rgb_array[..., :3]
+    if rgb.dtype != np.uint8:
+        return _classify_elements_float(rgb)
+    r, g, b = (rgb[..., c].astype(np.int16) for c in range(3))
+
+    # 全部换成int16整数比较，不做浮点HSV换算：
+    # 色相用 (度/10)×Δ 表示，饱和度、明度阈值也都换算成整数不等式
+    maxc = np.maximum(np.maximum(r, g), b)
+    delta = maxc - np.minimum(np.minimum(r, g), b)
+    # 红为最大时 (g-b)，绿为最大时 (2Δ+b-r)，蓝为最大时 (4Δ+r-g)，单位60度，负值绕回一圈
+    hue = np.where(r == maxc, g - b, np.where(g == maxc, 2 * delta + b - r, 4 * delta + r - g))
+    hue += np.where(hue < 0, 6 * delta, 0).astype(np.int16)
+    hue *= 6
+
+    # 按优先级从低到高覆盖，与color_to_wuxing的判断顺序等价（各色相区间互不重叠，赤色即默认值）
+    wood, fire, earth, metal, water = range(len(ELEMENTS))
+    result = np.full(maxc.shape, fire, dtype=np.int8)                           # 赤色属火 / 紫为火之余气
+    result[(hue >= 6 * delta) & (hue < 15 * delta)] = wood                      # 青色属木（60-150度）
+    result[(hue >= 15 * delta) & (hue < 25 * delta)] = water                    # 玄色属水（150-250度）
+    result[maxc <= 38] = water                                                  # 玄冥之色（v<0.15）
+    result[(hue >= 4 * delta) & (hue <= 6 * delta) & (2 * delta > maxc)] = earth  # 中央土色（40-60度，s>0.5）
+    result[(5 * delta < maxc) & (maxc > 204)] = metal                           # 低饱和高明度（s<0.2，v>0.8）
+
+    # 恰好落在边界上的颜色，colorsys的浮点舍入可能落到边界另一侧，这部分按浮点重算
+    tie = (5 * delta == maxc) | (2 * delta == maxc)
+    for edge in (4, 6, 15, 25, 35):
+        tie |= (hue == edge * delta) & (delta > 0)
+    if tie.any():
+        result[tie] = _classify_elements_float(rgb[tie])
+    return result
+
+
+def _classify_elements_float(rgb_array):
+    """浮点版本，与colorsys.rgb_to_hsv逐位一致"""
+    rgb = rgb_array[..., :3] / 255.0  # 用float64，保证色环边界与colorsys一致
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+    # RGB -> HSV，与colorsys.rgb_to_hsv的分支顺序保持一致
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    delta = maxc - minc
+    v = maxc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.where(maxc > 0, delta / maxc, 0)
+        rc = (maxc - r) / delta
+        gc = (maxc - g) / delta
+        bc = (maxc - b) / delta
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(delta > 0, (h / 6.0) % 1.0, 0)
+    h_degree = h * 360
+
+    wood, fire, earth, metal, water = range(len(ELEMENTS))
+    conditions = [
+        (s < 0.2) & (v > 0.8),                       # 低饱和高明度
+        (h_degree >= 40) & (h_degree <= 60) & (s > 0.5),  # 中央土色
+        v < 0.15,                                    # 玄冥之色
+        (h_degree < 40) | (h_degree >= 350),         # 赤色属火
+        (h_degree >= 60) & (h_degree < 150),         # 青色属木
+        (h_degree >= 150) & (h_degree < 250),        # 玄色属水
+    ]
+    choices = [metal, earth, water, fire, wood, water]
+    return np.select(conditions, choices, default=fire).astype(np.int8)  # 紫为火之余气
+
+
 def find_system_font():
     # 常见 Linux 字体路径列表
     font_dirs = [